@@ -166,6 +166,86 @@ CREATE TABLE public.messages (
     seen_at TIMESTAMP WITH TIME ZONE
 );
 
+-- Inbox: unread counts per (receiver, contact) and both directions of a conversation.
+CREATE INDEX IF NOT EXISTS idx_messages_receiver_sender_seen ON public.messages(receiver_id, sender_id, seen);
+CREATE INDEX IF NOT EXISTS idx_messages_sender_receiver ON public.messages(sender_id, receiver_id);
+
+
+---------------------------------------------------------
+-- POST STATS (denormalized karma / comment counters)
+---------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS public.post_stats (
+    post_id INTEGER PRIMARY KEY REFERENCES public.posts(id) ON UPDATE CASCADE ON DELETE CASCADE,
+    karma INTEGER NOT NULL DEFAULT 0,
+    comments_count INTEGER NOT NULL DEFAULT 0,
+    needs_rescore BOOLEAN NOT NULL DEFAULT TRUE,
+    activity DOUBLE PRECISION
+);
+
+ALTER TABLE public.post_stats ADD COLUMN IF NOT EXISTS needs_rescore BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE public.post_stats ADD COLUMN IF NOT EXISTS activity DOUBLE PRECISION;
+
+-- Precomputed "hot" ranking, refreshed by `flask posts rescore-hot`.
+ALTER TABLE public.posts ADD COLUMN IF NOT EXISTS hot_score DOUBLE PRECISION NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_posts_subthread_hot ON public.posts(subthread_id, hot_score DESC);
+CREATE INDEX IF NOT EXISTS idx_post_stats_needs_rescore ON public.post_stats(post_id) WHERE needs_rescore;
+
+
+---------------------------------------------------------
+-- SUBTHREAD STATS (denormalized member / post / comment counters)
+---------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS public.subthread_stats (
+    subthread_id INTEGER PRIMARY KEY REFERENCES public.subthreads(id) ON UPDATE CASCADE ON DELETE CASCADE,
+    members_count INTEGER NOT NULL DEFAULT 0,
+    posts_count INTEGER NOT NULL DEFAULT 0,
+    comments_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_subthread_stats_members ON public.subthread_stats(members_count DESC);
+CREATE INDEX IF NOT EXISTS idx_subthread_stats_posts ON public.subthread_stats(posts_count DESC);
+
+
+---------------------------------------------------------
+-- USER STATS (per-user karma ledger)
+---------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS public.user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES public.users(id) ON UPDATE CASCADE ON DELETE CASCADE,
+    posts_count INTEGER NOT NULL DEFAULT 0,
+    posts_karma INTEGER NOT NULL DEFAULT 0,
+    comments_count INTEGER NOT NULL DEFAULT 0,
+    comments_karma INTEGER NOT NULL DEFAULT 0
+);
+
+
+---------------------------------------------------------
+-- INBOX STATS (per-user unread message counter)
+---------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS public.inbox_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES public.users(id) ON UPDATE CASCADE ON DELETE CASCADE,
+    unread_count INTEGER NOT NULL DEFAULT 0
+);
+
+
+---------------------------------------------------------
+-- KARMA JOURNAL (vote deltas not yet applied to post_stats / user_stats)
+---------------------------------------------------------
+
+-- Votes append here instead of updating the shared counter rows, so a burst of
+-- votes on one post never queues on a row lock; `flask reactions flush-karma`
+-- folds the rows into the counters in batches. Karma counters therefore lag the
+-- reactions table by whatever is still pending here.
+CREATE TABLE IF NOT EXISTS public.karma_journal (
+    id BIGSERIAL PRIMARY KEY,
+    post_id INTEGER REFERENCES public.posts(id) ON UPDATE CASCADE ON DELETE CASCADE,
+    comment_id INTEGER REFERENCES public.comments(id) ON UPDATE CASCADE ON DELETE CASCADE,
+    delta INTEGER NOT NULL
+);
+
 
 ---------------------------------------------------------
 -- TRIGGER FOR UPDATED_AT IN SUBTHREADS
@@ -185,18 +265,555 @@ CREATE TRIGGER update_subthreads_updated_at
     EXECUTE FUNCTION update_updated_at_column();
 
 
+---------------------------------------------------------
+-- TRIGGERS MAINTAINING POST STATS
+---------------------------------------------------------
+
+-- Engagement velocity: post_stats.activity is LOG(SUM(10 ^ (t / 45000))) over the
+-- post's creation and each comment and vote on it, t being the event's epoch seconds
+-- (kept in log form, the powers themselves overflow). An event counts ten times less
+-- for every 12.5 hours it is older, so activity ranks posts by their recent engagement
+-- rate, and that ranking holds as time passes: the value only changes when new
+-- engagement arrives. A post nobody has engaged with scores by its creation time.
+CREATE OR REPLACE FUNCTION post_activity_add(activity DOUBLE PRECISION, event_at TIMESTAMP WITH TIME ZONE, events INTEGER DEFAULT 1)
+RETURNS DOUBLE PRECISION AS $$
+    SELECT CASE
+        WHEN events <= 0 THEN activity
+        WHEN activity IS NULL THEN e.t
+        ELSE GREATEST(activity, e.t) + LOG(1 + POWER(10::DOUBLE PRECISION, -LEAST(ABS(activity - e.t), 300)))
+    END
+    FROM (
+        SELECT EXTRACT(EPOCH FROM event_at)::DOUBLE PRECISION / 45000 + LOG(GREATEST(events, 1)::DOUBLE PRECISION) AS t
+    ) e;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Karma is log-scaled and time enters only through activity, so a post's score
+-- only changes when its karma or activity does.
+DROP FUNCTION IF EXISTS post_hot_score(INTEGER, INTEGER, TIMESTAMP WITH TIME ZONE);
+CREATE OR REPLACE FUNCTION post_hot_score(karma INTEGER, activity DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION AS $$
+    SELECT (
+        SIGN(karma) * LOG(GREATEST(ABS(karma), 1)::DOUBLE PRECISION)
+        + COALESCE(activity, 0)
+    )::DOUBLE PRECISION;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION post_hot_score_on_post_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.hot_score = post_hot_score(0, post_activity_add(NULL, COALESCE(NEW.created_at, CURRENT_TIMESTAMP)));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION post_stats_on_post_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO public.post_stats (post_id, activity)
+    VALUES (NEW.id, post_activity_add(NULL, COALESCE(NEW.created_at, CURRENT_TIMESTAMP)))
+    ON CONFLICT (post_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION post_stats_on_comment_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.post_id IS NOT DISTINCT FROM NEW.post_id THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.post_stats
+        SET comments_count = comments_count - 1,
+            needs_rescore = TRUE
+        WHERE post_id = OLD.post_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE public.post_stats
+        SET comments_count = comments_count + 1,
+            activity = post_activity_add(activity, CURRENT_TIMESTAMP),
+            needs_rescore = TRUE
+        WHERE post_id = NEW.post_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS post_hot_score_post_insert ON public.posts;
+CREATE TRIGGER post_hot_score_post_insert
+    BEFORE INSERT ON public.posts
+    FOR EACH ROW
+    EXECUTE FUNCTION post_hot_score_on_post_insert();
+
+DROP TRIGGER IF EXISTS post_stats_post_insert ON public.posts;
+CREATE TRIGGER post_stats_post_insert
+    AFTER INSERT ON public.posts
+    FOR EACH ROW
+    EXECUTE FUNCTION post_stats_on_post_insert();
+
+-- Votes reach post_stats.karma through karma_journal (see below).
+DROP TRIGGER IF EXISTS post_stats_reaction_change ON public.reactions;
+DROP FUNCTION IF EXISTS post_stats_on_reaction_change();
+
+DROP TRIGGER IF EXISTS post_stats_comment_change ON public.comments;
+CREATE TRIGGER post_stats_comment_change
+    AFTER INSERT OR UPDATE OF post_id OR DELETE ON public.comments
+    FOR EACH ROW
+    EXECUTE FUNCTION post_stats_on_comment_change();
+
+-- Backfill (and repair) counters for posts that existed before the triggers.
+INSERT INTO public.post_stats (post_id, karma, comments_count)
+SELECT
+    p.id,
+    COALESCE((
+        SELECT SUM(CASE WHEN r.is_upvote THEN 1 ELSE -1 END)
+        FROM public.reactions r
+        WHERE r.post_id = p.id
+    ), 0) - COALESCE((SELECT SUM(j.delta) FROM public.karma_journal j WHERE j.post_id = p.id), 0),
+    (SELECT COUNT(*) FROM public.comments c WHERE c.post_id = p.id)
+FROM public.posts p
+ON CONFLICT (post_id) DO UPDATE
+SET karma = EXCLUDED.karma,
+    comments_count = EXCLUDED.comments_count,
+    needs_rescore = TRUE;
+
+-- Backfill activity from the timestamps of existing posts, comments and votes.
+UPDATE public.post_stats s
+SET activity = a.activity,
+    needs_rescore = TRUE
+FROM (
+    SELECT post_id, MAX(top) + LOG(SUM(POWER(10::DOUBLE PRECISION, GREATEST(t - top, -300)))) AS activity
+    FROM (
+        SELECT post_id, t, MAX(t) OVER (PARTITION BY post_id) AS top
+        FROM (
+            SELECT id AS post_id, EXTRACT(EPOCH FROM created_at)::DOUBLE PRECISION / 45000 AS t FROM public.posts
+            UNION ALL
+            SELECT post_id, EXTRACT(EPOCH FROM created_at)::DOUBLE PRECISION / 45000 FROM public.comments
+            UNION ALL
+            SELECT post_id, EXTRACT(EPOCH FROM created_at)::DOUBLE PRECISION / 45000 FROM public.reactions WHERE post_id IS NOT NULL
+        ) events
+        WHERE t IS NOT NULL
+    ) timed
+    GROUP BY post_id
+) a
+WHERE s.post_id = a.post_id
+  AND s.activity IS NULL;
+
+-- Score existing posts from the backfilled counters so the hot feed is ranked as soon
+-- as the migration runs; later counter changes go through `flask posts rescore-hot`.
+UPDATE public.posts p
+SET hot_score = post_hot_score(s.karma, s.activity)
+FROM public.post_stats s
+WHERE s.post_id = p.id
+  AND p.hot_score IS DISTINCT FROM post_hot_score(s.karma, s.activity);
+
+CREATE INDEX IF NOT EXISTS idx_reactions_post_id ON public.reactions(post_id);
+CREATE INDEX IF NOT EXISTS idx_comments_post_id ON public.comments(post_id);
+CREATE INDEX IF NOT EXISTS idx_comments_parent_id ON public.comments(parent_id);
+
+
+---------------------------------------------------------
+-- TRIGGERS MAINTAINING SUBTHREAD STATS
+---------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION subthread_stats_on_subthread_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO public.subthread_stats (subthread_id) VALUES (NEW.id)
+    ON CONFLICT (subthread_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION subthread_stats_on_subscription_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.subthread_id IS NOT DISTINCT FROM NEW.subthread_id THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.subthread_stats SET members_count = members_count - 1
+        WHERE subthread_id = OLD.subthread_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE public.subthread_stats SET members_count = members_count + 1
+        WHERE subthread_id = NEW.subthread_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Runs BEFORE DELETE: the post's comments are removed by the FK cascade, and by
+-- the time their own triggers fire the post row (and its subthread) is gone.
+CREATE OR REPLACE FUNCTION subthread_stats_on_post_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    post_comments INTEGER;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.subthread_id IS NOT DISTINCT FROM NEW.subthread_id THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT COUNT(*) INTO post_comments FROM public.comments WHERE post_id = OLD.id;
+        UPDATE public.subthread_stats
+        SET posts_count = posts_count - 1,
+            comments_count = comments_count - post_comments
+        WHERE subthread_id = OLD.subthread_id;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        UPDATE public.subthread_stats
+        SET posts_count = posts_count + 1,
+            comments_count = comments_count + post_comments
+        WHERE subthread_id = NEW.subthread_id;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION subthread_stats_on_post_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE public.subthread_stats SET posts_count = posts_count + 1
+    WHERE subthread_id = NEW.subthread_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION subthread_stats_on_comment_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.post_id IS NOT DISTINCT FROM NEW.post_id THEN
+        RETURN NULL;
+    END IF;
+    -- A comment removed by its post's cascade finds no post here; the post
+    -- trigger has already taken it off the subthread's count.
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.subthread_stats s SET comments_count = s.comments_count - 1
+        FROM public.posts p
+        WHERE p.id = OLD.post_id AND s.subthread_id = p.subthread_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE public.subthread_stats s SET comments_count = s.comments_count + 1
+        FROM public.posts p
+        WHERE p.id = NEW.post_id AND s.subthread_id = p.subthread_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS subthread_stats_subthread_insert ON public.subthreads;
+CREATE TRIGGER subthread_stats_subthread_insert
+    AFTER INSERT ON public.subthreads
+    FOR EACH ROW
+    EXECUTE FUNCTION subthread_stats_on_subthread_insert();
+
+DROP TRIGGER IF EXISTS subthread_stats_subscription_change ON public.subscriptions;
+CREATE TRIGGER subthread_stats_subscription_change
+    AFTER INSERT OR UPDATE OF subthread_id OR DELETE ON public.subscriptions
+    FOR EACH ROW
+    EXECUTE FUNCTION subthread_stats_on_subscription_change();
+
+DROP TRIGGER IF EXISTS subthread_stats_post_insert ON public.posts;
+CREATE TRIGGER subthread_stats_post_insert
+    AFTER INSERT ON public.posts
+    FOR EACH ROW
+    EXECUTE FUNCTION subthread_stats_on_post_insert();
+
+DROP TRIGGER IF EXISTS subthread_stats_post_change ON public.posts;
+CREATE TRIGGER subthread_stats_post_change
+    BEFORE UPDATE OF subthread_id OR DELETE ON public.posts
+    FOR EACH ROW
+    EXECUTE FUNCTION subthread_stats_on_post_change();
+
+DROP TRIGGER IF EXISTS subthread_stats_comment_change ON public.comments;
+CREATE TRIGGER subthread_stats_comment_change
+    AFTER INSERT OR UPDATE OF post_id OR DELETE ON public.comments
+    FOR EACH ROW
+    EXECUTE FUNCTION subthread_stats_on_comment_change();
+
+-- Backfill (and repair) counters; `flask threads reconcile-stats` runs the same query.
+INSERT INTO public.subthread_stats (subthread_id, members_count, posts_count, comments_count)
+SELECT
+    s.id,
+    (SELECT COUNT(*) FROM public.subscriptions m WHERE m.subthread_id = s.id),
+    (SELECT COUNT(*) FROM public.posts p WHERE p.subthread_id = s.id),
+    (SELECT COUNT(*) FROM public.comments c JOIN public.posts p ON p.id = c.post_id WHERE p.subthread_id = s.id)
+FROM public.subthreads s
+ON CONFLICT (subthread_id) DO UPDATE
+SET members_count = EXCLUDED.members_count,
+    posts_count = EXCLUDED.posts_count,
+    comments_count = EXCLUDED.comments_count;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_subthread_id ON public.subscriptions(subthread_id);
+CREATE INDEX IF NOT EXISTS idx_posts_subthread_id ON public.posts(subthread_id);
+
+
+---------------------------------------------------------
+-- TRIGGERS MAINTAINING USER STATS
+---------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION user_stats_on_user_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO public.user_stats (user_id) VALUES (NEW.id)
+    ON CONFLICT (user_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_stats_on_post_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE public.user_stats SET posts_count = posts_count + 1
+    WHERE user_id = NEW.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Post and comment deletes run BEFORE DELETE: their reactions are removed by
+-- the FK cascade afterwards, when the author can no longer be looked up, so the
+-- karma already applied to the ledger is taken off here. Deltas still pending
+-- in karma_journal are dropped with the row and never reach the ledger.
+CREATE OR REPLACE FUNCTION user_stats_on_post_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE public.user_stats
+    SET posts_count = posts_count - 1,
+        posts_karma = posts_karma - COALESCE((SELECT karma FROM public.post_stats WHERE post_id = OLD.id), 0)
+    WHERE user_id = OLD.user_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_stats_on_comment_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE public.user_stats SET comments_count = comments_count + 1
+    WHERE user_id = NEW.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_stats_on_comment_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE public.user_stats
+    SET comments_count = comments_count - 1,
+        comments_karma = comments_karma - COALESCE((
+            SELECT SUM(CASE WHEN r.is_upvote THEN 1 ELSE -1 END)
+            FROM public.reactions r
+            WHERE r.comment_id = OLD.id
+        ), 0) + COALESCE((SELECT SUM(j.delta) FROM public.karma_journal j WHERE j.comment_id = OLD.id), 0)
+    WHERE user_id = OLD.user_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_stats_user_insert ON public.users;
+CREATE TRIGGER user_stats_user_insert
+    AFTER INSERT ON public.users
+    FOR EACH ROW
+    EXECUTE FUNCTION user_stats_on_user_insert();
+
+DROP TRIGGER IF EXISTS user_stats_post_insert ON public.posts;
+CREATE TRIGGER user_stats_post_insert
+    AFTER INSERT ON public.posts
+    FOR EACH ROW
+    EXECUTE FUNCTION user_stats_on_post_insert();
+
+DROP TRIGGER IF EXISTS user_stats_post_delete ON public.posts;
+CREATE TRIGGER user_stats_post_delete
+    BEFORE DELETE ON public.posts
+    FOR EACH ROW
+    EXECUTE FUNCTION user_stats_on_post_delete();
+
+DROP TRIGGER IF EXISTS user_stats_comment_insert ON public.comments;
+CREATE TRIGGER user_stats_comment_insert
+    AFTER INSERT ON public.comments
+    FOR EACH ROW
+    EXECUTE FUNCTION user_stats_on_comment_insert();
+
+DROP TRIGGER IF EXISTS user_stats_comment_delete ON public.comments;
+CREATE TRIGGER user_stats_comment_delete
+    BEFORE DELETE ON public.comments
+    FOR EACH ROW
+    EXECUTE FUNCTION user_stats_on_comment_delete();
+
+-- Votes reach posts_karma / comments_karma through karma_journal (see below).
+DROP TRIGGER IF EXISTS user_stats_reaction_change ON public.reactions;
+DROP FUNCTION IF EXISTS user_stats_on_reaction_change();
+
+-- Backfill (and repair) the ledger; `flask users rebuild-karma` runs the same query.
+INSERT INTO public.user_stats (user_id, posts_count, posts_karma, comments_count, comments_karma)
+SELECT
+    u.id,
+    (SELECT COUNT(*) FROM public.posts p WHERE p.user_id = u.id),
+    COALESCE((
+        SELECT SUM(CASE WHEN r.is_upvote THEN 1 ELSE -1 END)
+        FROM public.posts p JOIN public.reactions r ON r.post_id = p.id
+        WHERE p.user_id = u.id
+    ), 0) - COALESCE((
+        SELECT SUM(j.delta)
+        FROM public.posts p JOIN public.karma_journal j ON j.post_id = p.id
+        WHERE p.user_id = u.id
+    ), 0),
+    (SELECT COUNT(*) FROM public.comments c WHERE c.user_id = u.id),
+    COALESCE((
+        SELECT SUM(CASE WHEN r.is_upvote THEN 1 ELSE -1 END)
+        FROM public.comments c JOIN public.reactions r ON r.comment_id = c.id
+        WHERE c.user_id = u.id
+    ), 0) - COALESCE((
+        SELECT SUM(j.delta)
+        FROM public.comments c JOIN public.karma_journal j ON j.comment_id = c.id
+        WHERE c.user_id = u.id
+    ), 0)
+FROM public.users u
+ON CONFLICT (user_id) DO UPDATE
+SET posts_count = EXCLUDED.posts_count,
+    posts_karma = EXCLUDED.posts_karma,
+    comments_count = EXCLUDED.comments_count,
+    comments_karma = EXCLUDED.comments_karma;
+
+CREATE INDEX IF NOT EXISTS idx_reactions_comment_id ON public.reactions(comment_id);
+CREATE INDEX IF NOT EXISTS idx_posts_user_id ON public.posts(user_id);
+CREATE INDEX IF NOT EXISTS idx_comments_user_id ON public.comments(user_id);
+
+
+---------------------------------------------------------
+-- TRIGGERS MAINTAINING THE KARMA JOURNAL
+---------------------------------------------------------
+
+-- Reactions removed by a post/comment cascade are skipped: that row is already
+-- gone and its karma was taken off by the BEFORE DELETE triggers above.
+CREATE OR REPLACE FUNCTION karma_journal_on_reaction_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+        AND OLD.is_upvote = NEW.is_upvote
+        AND OLD.post_id IS NOT DISTINCT FROM NEW.post_id
+        AND OLD.comment_id IS NOT DISTINCT FROM NEW.comment_id THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO public.karma_journal (post_id, comment_id, delta)
+        SELECT OLD.post_id, OLD.comment_id, CASE WHEN OLD.is_upvote THEN -1 ELSE 1 END
+        WHERE (OLD.post_id IS NULL OR EXISTS (SELECT 1 FROM public.posts WHERE id = OLD.post_id))
+          AND (OLD.comment_id IS NULL OR EXISTS (SELECT 1 FROM public.comments WHERE id = OLD.comment_id));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.karma_journal (post_id, comment_id, delta)
+        VALUES (NEW.post_id, NEW.comment_id, CASE WHEN NEW.is_upvote THEN 1 ELSE -1 END);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS karma_journal_reaction_change ON public.reactions;
+CREATE TRIGGER karma_journal_reaction_change
+    AFTER INSERT OR UPDATE OF is_upvote, post_id, comment_id OR DELETE ON public.reactions
+    FOR EACH ROW
+    EXECUTE FUNCTION karma_journal_on_reaction_change();
+
+
+---------------------------------------------------------
+-- ONE REACTION / SAVE / SUBSCRIPTION PER USER AND TARGET
+---------------------------------------------------------
+
+-- Databases created before the UNIQUE constraints above may hold duplicates.
+-- Keep the newest reaction (the user's latest vote) and the oldest save and
+-- subscription; the stats triggers take the removed rows off the counters.
+-- `flask users dedupe-relations` runs the same statements.
+DELETE FROM public.reactions r
+USING public.reactions newer
+WHERE newer.user_id = r.user_id AND newer.post_id = r.post_id AND newer.id > r.id;
+
+DELETE FROM public.reactions r
+USING public.reactions newer
+WHERE newer.user_id = r.user_id AND newer.comment_id = r.comment_id AND newer.id > r.id;
+
+DELETE FROM public.saved s
+USING public.saved older
+WHERE older.user_id = s.user_id AND older.post_id = s.post_id AND older.id < s.id;
+
+DELETE FROM public.subscriptions s
+USING public.subscriptions older
+WHERE older.user_id = s.user_id AND older.subthread_id = s.subthread_id AND older.id < s.id;
+
+-- Named like the constraints of the CREATE TABLE statements, so tables that
+-- already have them are left alone. The ON CONFLICT write paths rely on these.
+CREATE UNIQUE INDEX IF NOT EXISTS reactions_user_id_post_id_key ON public.reactions(user_id, post_id);
+CREATE UNIQUE INDEX IF NOT EXISTS reactions_user_id_comment_id_key ON public.reactions(user_id, comment_id);
+CREATE UNIQUE INDEX IF NOT EXISTS saved_user_id_post_id_key ON public.saved(user_id, post_id);
+CREATE UNIQUE INDEX IF NOT EXISTS subscriptions_user_id_subthread_id_key ON public.subscriptions(user_id, subthread_id);
+
+
+---------------------------------------------------------
+-- TRIGGERS MAINTAINING INBOX STATS
+---------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION inbox_stats_on_user_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO public.inbox_stats (user_id) VALUES (NEW.id)
+    ON CONFLICT (user_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION inbox_stats_on_message_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND NOT OLD.seen THEN
+        UPDATE public.inbox_stats SET unread_count = unread_count - 1
+        WHERE user_id = OLD.receiver_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NOT NEW.seen THEN
+        UPDATE public.inbox_stats SET unread_count = unread_count + 1
+        WHERE user_id = NEW.receiver_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS inbox_stats_user_insert ON public.users;
+CREATE TRIGGER inbox_stats_user_insert
+    AFTER INSERT ON public.users
+    FOR EACH ROW
+    EXECUTE FUNCTION inbox_stats_on_user_insert();
+
+DROP TRIGGER IF EXISTS inbox_stats_message_change ON public.messages;
+CREATE TRIGGER inbox_stats_message_change
+    AFTER INSERT OR UPDATE OF seen, receiver_id OR DELETE ON public.messages
+    FOR EACH ROW
+    EXECUTE FUNCTION inbox_stats_on_message_change();
+
+-- Backfill (and repair) unread counters.
+INSERT INTO public.inbox_stats (user_id, unread_count)
+SELECT u.id, (SELECT COUNT(*) FROM public.messages m WHERE m.receiver_id = u.id AND NOT m.seen)
+FROM public.users u
+ON CONFLICT (user_id) DO UPDATE
+SET unread_count = EXCLUDED.unread_count;
+
+
 ---------------------------------------------------------
 -- VIEWS
 ---------------------------------------------------------
 
 -- POST INFO VIEW
-CREATE OR REPLACE VIEW public.post_info AS
+-- Counters come from post_stats, so reading a page of posts no longer
+-- aggregates the whole reactions/comments tables. The view is dropped first
+-- because the counter columns changed type (BIGINT aggregates -> INTEGER).
+DROP VIEW IF EXISTS public.post_info;
+CREATE VIEW public.post_info AS
 SELECT
     t.id AS thread_id,
     t.name AS thread_name,
     t.logo AS thread_logo,
     p.id AS post_id,
-    k.karma AS post_karma,
+    s.karma AS post_karma,
     p.title,
     p.media,
     p.is_edited,
@@ -205,55 +822,28 @@ SELECT
     u.id AS user_id,
     u.username AS user_name,
     u.avatar AS user_avatar,
-    c.comments_count
+    s.comments_count,
+    p.hot_score
 FROM public.posts p
-JOIN (
-    SELECT p.id AS post_id,
-           COALESCE(SUM(
-              CASE WHEN r.is_upvote THEN 1
-                   WHEN r.is_upvote = FALSE THEN -1
-                   ELSE 0 END
-           ), 0) AS karma
-    FROM public.posts p
-    LEFT JOIN public.reactions r ON r.post_id = p.id
-    GROUP BY p.id
-) k ON k.post_id = p.id
-JOIN (
-    SELECT p.id AS post_id, COUNT(c.id) AS comments_count
-    FROM public.posts p
-    LEFT JOIN public.comments c ON c.post_id = p.id
-    GROUP BY p.id
-) c ON c.post_id = p.id
+JOIN public.post_stats s ON s.post_id = p.id
 JOIN public.subthreads t ON t.id = p.subthread_id
 JOIN public.users u ON u.id = p.user_id;
 
 
 -- SUBTHREAD INFO VIEW
-CREATE OR REPLACE VIEW public.subthread_info AS
+-- Counters come from subthread_stats. Recreated rather than replaced because the
+-- counter columns changed type (BIGINT aggregates -> INTEGER).
+DROP VIEW IF EXISTS public.subthread_info;
+CREATE VIEW public.subthread_info AS
 SELECT
     s.id,
     s.name,
     s.logo,
-    m.members_count,
-    p.posts_count,
-    c.comments_count
+    st.members_count,
+    st.posts_count,
+    st.comments_count
 FROM public.subthreads s
-LEFT JOIN (
-    SELECT subthread_id, COUNT(*) AS members_count
-    FROM public.subscriptions
-    GROUP BY subthread_id
-) m ON m.subthread_id = s.id
-LEFT JOIN (
-    SELECT subthread_id, COUNT(*) AS posts_count
-    FROM public.posts
-    GROUP BY subthread_id
-) p ON p.subthread_id = s.id
-LEFT JOIN (
-    SELECT posts.subthread_id, COUNT(comments.id) AS comments_count
-    FROM public.posts
-    LEFT JOIN public.comments ON comments.post_id = posts.id
-    GROUP BY posts.subthread_id
-) c ON c.subthread_id = s.id;
+JOIN public.subthread_stats st ON st.subthread_id = s.id;
 
 
 -- COMMENT INFO VIEW
@@ -286,41 +876,18 @@ LEFT JOIN public.posts p ON p.id = c.post_id;
 
 
 -- USER INFO VIEW
-CREATE OR REPLACE VIEW public.user_info AS
+-- Reads the user_stats ledger. Recreated rather than replaced because the
+-- counter columns changed type (BIGINT aggregates -> INTEGER).
+DROP VIEW IF EXISTS public.user_info;
+CREATE VIEW public.user_info AS
 SELECT
-    u.id AS user_id,
-    (c.karma + p.karma) AS user_karma,
-    c.comments_count,
-    c.karma AS comments_karma,
-    p.posts_count,
-    p.karma AS posts_karma
-FROM public.users u
-LEFT JOIN (
-    SELECT u.id AS user_id,
-           COUNT(c.id) AS comments_count,
-           COALESCE(SUM(
-               CASE WHEN r.is_upvote AND r.comment_id IS NOT NULL THEN 1
-                    WHEN NOT r.is_upvote AND r.comment_id IS NOT NULL THEN -1
-                    ELSE 0 END
-           ), 0) AS karma
-    FROM public.users u
-    LEFT JOIN public.comments c ON c.user_id = u.id
-    LEFT JOIN public.reactions r ON r.comment_id = c.id
-    GROUP BY u.id
-) c ON c.user_id = u.id
-LEFT JOIN (
-    SELECT u.id AS user_id,
-           COUNT(p.id) AS posts_count,
-           COALESCE(SUM(
-               CASE WHEN r.is_upvote AND r.post_id IS NOT NULL THEN 1
-                    WHEN NOT r.is_upvote AND r.post_id IS NOT NULL THEN -1
-                    ELSE 0 END
-           ), 0) AS karma
-    FROM public.users u
-    LEFT JOIN public.posts p ON p.user_id = u.id
-    LEFT JOIN public.reactions r ON r.post_id = p.id
-    GROUP BY u.id
-) p ON p.user_id = u.id;
+    s.user_id,
+    (s.comments_karma + s.posts_karma) AS user_karma,
+    s.comments_count,
+    s.comments_karma,
+    s.posts_count,
+    s.posts_karma
+FROM public.user_stats s;
 
 
 ---------------------------------------------------------
@@ -372,6 +939,120 @@ CREATE TABLE IF NOT EXISTS public.deletion_history (
 
 CREATE INDEX IF NOT EXISTS idx_deletion_history_deleted_at ON public.deletion_history(deleted_at);
 CREATE INDEX IF NOT EXISTS idx_deletion_history_post_id ON public.deletion_history(post_id);
+CREATE INDEX IF NOT EXISTS idx_deletion_history_original_author_id ON public.deletion_history(original_author_id);
+
+
+---------------------------------------------------------
+-- USER RISK (precomputed suspicious-activity scores)
+---------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS public.user_risk (
+    user_id INTEGER PRIMARY KEY REFERENCES public.users(id) ON UPDATE CASCADE ON DELETE CASCADE,
+    score INTEGER NOT NULL DEFAULT 0,
+    level TEXT NOT NULL DEFAULT 'none',
+    flags JSONB NOT NULL DEFAULT '[]'::jsonb,
+    needs_rescore BOOLEAN NOT NULL DEFAULT TRUE,
+    recheck_at TIMESTAMP WITH TIME ZONE,
+    scored_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_risk_score ON public.user_risk(score DESC, user_id);
+CREATE INDEX IF NOT EXISTS idx_user_risk_needs_rescore ON public.user_risk(user_id) WHERE needs_rescore;
+CREATE INDEX IF NOT EXISTS idx_user_risk_recheck_at ON public.user_risk(recheck_at) WHERE recheck_at IS NOT NULL;
+
+-- Events only flag the user; `flask users rescore-risk` recomputes the score.
+-- The update runs even when the row is already flagged: it then waits on a scorer
+-- holding the row, and re-flags it after that scorer (which may have read the
+-- stats before this event) clears the flag.
+CREATE OR REPLACE FUNCTION user_risk_mark(risk_user_id INTEGER)
+RETURNS VOID AS $$
+    UPDATE public.user_risk SET needs_rescore = TRUE
+    WHERE user_id = risk_user_id;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION user_risk_on_user_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO public.user_risk (user_id) VALUES (NEW.id)
+    ON CONFLICT (user_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_risk_on_authored_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM user_risk_mark(OLD.user_id);
+    ELSE
+        PERFORM user_risk_mark(NEW.user_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_risk_on_report_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM user_risk_mark(p.user_id)
+    FROM public.posts p
+    WHERE p.id = CASE WHEN TG_OP = 'DELETE' THEN OLD.post_id ELSE NEW.post_id END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_risk_on_deletion()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.original_author_id IS NOT NULL THEN
+        PERFORM user_risk_mark(NEW.original_author_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_risk_user_insert ON public.users;
+CREATE TRIGGER user_risk_user_insert
+    AFTER INSERT ON public.users
+    FOR EACH ROW
+    EXECUTE FUNCTION user_risk_on_user_insert();
+
+DROP TRIGGER IF EXISTS user_risk_post_change ON public.posts;
+CREATE TRIGGER user_risk_post_change
+    AFTER INSERT OR DELETE ON public.posts
+    FOR EACH ROW
+    EXECUTE FUNCTION user_risk_on_authored_change();
+
+DROP TRIGGER IF EXISTS user_risk_comment_change ON public.comments;
+CREATE TRIGGER user_risk_comment_change
+    AFTER INSERT OR DELETE ON public.comments
+    FOR EACH ROW
+    EXECUTE FUNCTION user_risk_on_authored_change();
+
+DROP TRIGGER IF EXISTS user_risk_report_change ON public.reports;
+CREATE TRIGGER user_risk_report_change
+    AFTER INSERT OR UPDATE OF status OR DELETE ON public.reports
+    FOR EACH ROW
+    EXECUTE FUNCTION user_risk_on_report_change();
+
+DROP TRIGGER IF EXISTS user_risk_deletion ON public.deletion_history;
+CREATE TRIGGER user_risk_deletion
+    AFTER INSERT ON public.deletion_history
+    FOR EACH ROW
+    EXECUTE FUNCTION user_risk_on_deletion();
+
+-- Karma only matters to the score when it crosses the negative-karma threshold.
+DROP TRIGGER IF EXISTS user_risk_karma_change ON public.user_stats;
+CREATE TRIGGER user_risk_karma_change
+    AFTER UPDATE OF posts_karma, comments_karma ON public.user_stats
+    FOR EACH ROW
+    WHEN ((OLD.posts_karma + OLD.comments_karma < -10) <> (NEW.posts_karma + NEW.comments_karma < -10))
+    EXECUTE FUNCTION user_risk_on_authored_change();
+
+-- Every existing user starts flagged, so the first scorer pass fills the table.
+INSERT INTO public.user_risk (user_id)
+SELECT id FROM public.users
+ON CONFLICT (user_id) DO NOTHING;
 
 ---------------------------------------------------------
 -- CHAT HISTORY (AI Assistant Chat History)
@@ -8,9 +8,41 @@ cd /home/site/wwwroot
 # Install dependencies if needed (Azure usually does this, but just in case)
 pip install -r requirements.txt --quiet
 
+# Gunicorn worker processes; exported so the app can check its cache setup against it.
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+
+# Background jobs run next to Gunicorn, one copy per instance. supervise restarts a
+# job that exits (database restart, transient error) so it can never silently stop.
+supervise() {
+    while true; do
+        "$@"
+        echo "[startup] '$*' exited with status $?, restarting in 5s" >&2
+        sleep 5
+    done
+}
+
+# Votes only reach post scores and user karma through karma_journal; this job applies
+# the journal every KARMA_FLUSH_INTERVAL seconds (flushes use SKIP LOCKED, so several
+# instances can run it side by side).
+supervise flask --app threaddit reactions flush-karma --interval ${KARMA_FLUSH_INTERVAL:-2} &
+
+# Recomputes posts.hot_score for posts whose karma or comment counters changed.
+supervise flask --app threaddit posts rescore-hot --interval ${HOT_RESCORE_INTERVAL:-30} &
+
+# Recomputes suspicious-activity scores for users flagged by the user_risk triggers
+# and for users whose sliding-window counts have expired.
+supervise flask --app threaddit users rescore-risk --interval ${RISK_RESCORE_INTERVAL:-60} &
+
 # Start Gunicorn
 # Azure App Service sets PORT environment variable automatically
 # Use 0.0.0.0 to bind to all interfaces
 # Default to port 8000 if PORT is not set
-gunicorn --bind 0.0.0.0:${PORT:-8000} --workers 4 --timeout 120 --access-logfile - --error-logfile - threaddit:app
+# gthread workers keep /api/messages/stream (server-sent events) connections open
+# on threads instead of tying up a whole worker per connected client. Each open tab
+# holds one thread, so streams are capped at MESSAGE_STREAM_MAX_PER_WORKER (default 16)
+# per worker; past that the stream answers 503 and the client polls instead. Keep the
+# cap well below GUNICORN_THREADS so regular API requests always find a free thread.
+# With more than one worker set CACHE_REDIS_URL, otherwise each worker caches and
+# invalidates feeds on its own.
+gunicorn --bind 0.0.0.0:${PORT:-8000} --workers $WEB_CONCURRENCY --worker-class gthread --threads ${GUNICORN_THREADS:-32} --timeout 120 --access-logfile - --error-logfile - threaddit:app
 
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Response, g, make_response, request
+from flask_login import current_user
+from sqlalchemy import bindparam, event, text
+from threaddit import db
+from threaddit.config import CACHE_MAX_ENTRIES, CACHE_REDIS_URL
+
+_PENDING_KEY = "cache_invalidations"
+METRICS = ("hits", "misses", "stores", "invalidations")
+
+
+class LocalCacheBackend:
+    """Per-process LRU with TTLs and a tag index, for a single worker or development."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._metrics = dict.fromkeys(METRICS, 0)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, tags = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, tags):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            keys = set().union(*(self._tags.pop(tag, ()) for tag in tags))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def incr(self, metric, amount=1):
+        with self._lock:
+            self._metrics[metric] += amount
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._metrics, entries=len(self._entries))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCacheBackend:
+    """Shared backend so every gunicorn worker sees the same entries and invalidations.
+
+    Each tag is a Redis set of the keys stored under it; entries expire on their
+    own and invalidation deletes the members of the tag sets.
+    """
+
+    def __init__(self, url, prefix="threaddit:cache:"):
+        import redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._redis.get(self.prefix + key)
+
+    def set(self, key, value, ttl, tags):
+        pipe = self._redis.pipeline()
+        pipe.set(self.prefix + key, value, ex=ttl)
+        for tag in tags:
+            pipe.sadd(self._tag_key(tag), self.prefix + key)
+            # Tag sets only need to outlive their entries; stale members are harmless.
+            pipe.expire(self._tag_key(tag), ttl * 2)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        tag_keys = [self._tag_key(tag) for tag in tags]
+        keys = self._redis.sunion(tag_keys) if tag_keys else set()
+        pipe = self._redis.pipeline()
+        if keys:
+            pipe.delete(*keys)
+        pipe.delete(*tag_keys)
+        pipe.execute()
+        return len(keys)
+
+    def incr(self, metric, amount=1):
+        self._redis.hincrby(self.prefix + "metrics", metric, amount)
+
+    def metrics(self):
+        stored = self._redis.hgetall(self.prefix + "metrics")
+        return {metric: int(stored.get(metric.encode(), 0)) for metric in METRICS}
+
+    def _tag_key(self, tag):
+        return f"{self.prefix}tag:{tag}"
+
+
+class ResponseCache:
+    """Caches JSON responses of anonymous GET requests, keyed by path and query args.
+
+    Entries are tagged (``subthread:<id>`` for pages built from one community,
+    ``subthreads`` for community listings) and dropped after commits that touch
+    posts, comments, subscriptions or moderators of those communities. Votes reach
+    cached pages when ``flask reactions flush-karma`` applies them to post karma.
+    Cache errors never fail a request; they are logged and the view runs as usual.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def cached(self, ttl=30, tags=()):
+        def wrapper(func):
+            @wraps(func)
+            def decorated(*args, **kwargs):
+                if request.method != "GET" or current_user.is_authenticated:
+                    return func(*args, **kwargs)
+                key = self._key()
+                entry = self._call("get", key)
+                if entry is not None:
+                    self._call("incr", "hits")
+                    return self._response(json.loads(entry))
+                self._call("incr", "misses")
+                g.cache_tags = set(tags)
+                response = make_response(func(*args, **kwargs))
+                if response.status_code == 200 and response.is_json:
+                    entry = {"body": response.get_data(as_text=True), "etag": response.get_etag()[0]}
+                    self._call("set", key, json.dumps(entry), ttl, sorted(g.cache_tags))
+                    self._call("incr", "stores")
+                return response
+
+            return decorated
+
+        return wrapper
+
+    def invalidate(self, tags):
+        if not tags:
+            return
+        removed = self._call("invalidate", tags)
+        if removed:
+            self._call("incr", "invalidations", removed)
+
+    def metrics(self):
+        metrics = self._call("metrics") or {}
+        lookups = metrics.get("hits", 0) + metrics.get("misses", 0)
+        metrics["hit_ratio"] = round(metrics.get("hits", 0) / lookups, 4) if lookups else None
+        metrics["backend"] = type(self.backend).__name__
+        return metrics
+
+    def _key(self):
+        args = urlencode(sorted(request.args.items(multi=True)))
+        return hashlib.sha1(f"{request.path}?{args}".encode()).hexdigest()
+
+    def _response(self, entry):
+        response = Response(entry["body"], mimetype="application/json")
+        if entry["etag"]:
+            response.set_etag(entry["etag"], weak=True)
+            response.headers["Cache-Control"] = "private, no-cache"
+        return response.make_conditional(request)
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            print(f"[ResponseCache] {method} failed: {str(e)}")
+            return None
+
+
+def cache_tags(*tags):
+    """Tag the cached response of the current request, for tags only known inside the view."""
+    if "cache_tags" in g:
+        g.cache_tags.update(tags)
+
+
+response_cache = ResponseCache(
+    RedisCacheBackend(CACHE_REDIS_URL) if CACHE_REDIS_URL else LocalCacheBackend(CACHE_MAX_ENTRIES)
+)
+
+
+def _affected_tags(session):
+    # Read attributes straight off the instances so deleted rows still resolve.
+    # Reactions are written with Core upserts and only change cached counters once
+    # KarmaJournal.flush applies them, which invalidates those pages itself.
+    tags, post_ids = set(), set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(instance, "__tablename__", None)
+        if table in ("posts", "subscriptions", "user_roles"):
+            if instance.subthread_id is not None:
+                tags.add(f"subthread:{instance.subthread_id}")
+            # Moderator changes leave the community counters alone.
+            if table != "user_roles":
+                tags.add("subthreads")
+        elif table == "subthreads":
+            tags.update((f"subthread:{instance.id}", "subthreads"))
+        elif table == "comments":
+            post_ids.add(instance.post_id)
+            tags.add("subthreads")
+    post_ids.discard(None)
+    if post_ids:
+        rows = session.connection().execute(
+            text("SELECT subthread_id FROM posts WHERE id IN :post_ids").bindparams(
+                bindparam("post_ids", expanding=True)
+            ),
+            {"post_ids": list(post_ids)},
+        )
+        tags.update(f"subthread:{row.subthread_id}" for row in rows if row.subthread_id is not None)
+    return tags
+
+
+def invalidate_on_commit(*tags):
+    """Drop the entries under ``tags`` once the current transaction commits.
+
+    ORM flushes are tracked automatically; statements that bypass the unit of
+    work (bulk inserts, ``ON CONFLICT`` upserts) must call this themselves.
+    """
+    db.session.info.setdefault(_PENDING_KEY, set()).update(tags)
+
+
+@event.listens_for(db.session, "before_flush")
+def _collect_invalidations(session, flush_context, instances):
+    tags = _affected_tags(session)
+    if tags:
+        session.info.setdefault(_PENDING_KEY, set()).update(tags)
+
+
+@event.listens_for(db.session, "after_commit")
+def _apply_invalidations(session):
+    response_cache.invalidate(session.info.pop(_PENDING_KEY, set()))
+
+
+@event.listens_for(db.session, "after_rollback")
+def _drop_invalidations(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -1,4 +1,5 @@
 from threaddit import db
+from sqlalchemy import text
 from threaddit.reactions.models import Reactions
 
 
@@ -62,7 +63,7 @@ class CommentInfo(db.Model):
     post = db.relationship("Posts", back_populates="comment_info")
     comment = db.relationship("Comments", back_populates="comment_info")
 
-    def as_dict(self, cur_user):
+    def as_dict(self, cur_user, user_reactions=None):
         comment_info = {
             "user_info": {
                 "user_name": self.user_name,
@@ -79,10 +80,62 @@ class CommentInfo(db.Model):
             },
         }
         if cur_user:
-            has_reaction = Reactions.query.filter_by(
-                comment_id=self.comment_id, user_id=cur_user
-            ).first()
+            if user_reactions is None:
+                user_reactions = CommentInfo.get_user_reactions([self.comment_id], cur_user)
             comment_info["current_user"] = {
-                "has_upvoted": has_reaction.is_upvote if has_reaction else None
+                "has_upvoted": user_reactions.get(self.comment_id)
             }
         return comment_info
+
+    @classmethod
+    def get_subtree(cls, post_id, parent_id=None, limit=20, offset=0, depth=3):
+        """Load a window of a post's comment tree with a single recursive CTE.
+
+        Takes ``limit`` comments (after ``offset``) directly under ``parent_id``, or the
+        top-level comments when it is None, plus up to ``depth`` levels of their replies.
+        Returns ``(rows, more_children, has_more)``: the CommentInfo rows ordered by id,
+        the reply count of comments whose replies were cut off by ``depth``, and whether
+        more top-level comments exist past this window.
+        """
+        root_filter = "parent_id IS NULL" if parent_id is None else "parent_id = :parent_id"
+        result = db.session.execute(
+            text(
+                f"""
+                WITH RECURSIVE roots AS (
+                    SELECT id FROM comments
+                    WHERE post_id = :post_id AND {root_filter}
+                    ORDER BY id
+                    LIMIT :limit + 1 OFFSET :offset
+                ), tree AS (
+                    SELECT id, 1 AS depth FROM (SELECT id FROM roots ORDER BY id LIMIT :limit) r
+                    UNION ALL
+                    SELECT c.id, t.depth + 1
+                    FROM comments c
+                    JOIN tree t ON c.parent_id = t.id
+                    WHERE t.depth < :depth
+                )
+                SELECT t.id,
+                       CASE WHEN t.depth = :depth
+                            THEN (SELECT COUNT(*) FROM comments k WHERE k.parent_id = t.id)
+                       END AS more_children,
+                       (SELECT COUNT(*) FROM roots) > :limit AS has_more
+                FROM tree t
+                """
+            ),
+            {"post_id": post_id, "parent_id": parent_id, "limit": limit, "offset": offset, "depth": depth},
+        ).all()
+        if not result:
+            return [], {}, False
+        more_children = {row.id: row.more_children for row in result if row.more_children}
+        rows = cls.query.filter(cls.comment_id.in_([row.id for row in result])).order_by(cls.comment_id).all()
+        return rows, more_children, bool(result[0].has_more)
+
+    @staticmethod
+    def get_user_reactions(comment_ids, cur_user):
+        if not comment_ids:
+            return {}
+        return dict(
+            db.session.query(Reactions.comment_id, Reactions.is_upvote).filter(
+                Reactions.user_id == cur_user, Reactions.comment_id.in_(comment_ids)
+            )
+        )
@@ -1,5 +1,6 @@
 from threaddit.comments.models import Comments, CommentInfo
 from threaddit import db
+from threaddit.cache import invalidate_on_commit
 from threaddit.posts.models import PostInfo
 from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
@@ -7,23 +8,70 @@ from threaddit.comments.utils import create_comment_tree
 
 comments = Blueprint("comments", __name__, url_prefix="/api")
 
+def _get_tree_window():
+    limit = request.args.get("limit", default=20, type=int)
+    offset = request.args.get("offset", default=0, type=int)
+    depth = request.args.get("depth", default=3, type=int)
+    if limit < 1 or offset < 0 or depth < 1:
+        return None
+    return min(limit, 100), offset, min(depth, 10)
+
+
 @comments.route("/comments/post/<pid>", methods=["GET"])
 def get_comments(pid):
     post_info = PostInfo.query.filter_by(post_id=pid).first()
     if not post_info:
         return jsonify({"message": "Invalid Post ID"}), 400
     
-    comments = (
-        CommentInfo.query.filter_by(post_id=pid).order_by(CommentInfo.has_parent.desc(), CommentInfo.comment_id).all()
-    )
-    
     cur_user = current_user.id if current_user.is_authenticated else None
+    # Without limit/offset/depth the whole tree is returned, as before.
+    paginated = any(arg in request.args for arg in ("limit", "offset", "depth"))
+    more_children, has_more = None, False
+    if paginated:
+        window = _get_tree_window()
+        if not window:
+            return jsonify({"message": "Invalid Request"}), 400
+        limit, offset, depth = window
+        comments, more_children, has_more = CommentInfo.get_subtree(
+            post_info.post_id, limit=limit, offset=offset, depth=depth
+        )
+    else:
+        comments = CommentInfo.query.filter_by(post_id=pid).order_by(CommentInfo.comment_id).all()
     
+    user_reactions = (
+        CommentInfo.get_user_reactions([c.comment_id for c in comments], cur_user) if cur_user else None
+    )
+    response = {
+        "post_info": post_info.as_dict(cur_user),
+        "comment_info": create_comment_tree(
+            comments=comments, cur_user=cur_user, user_reactions=user_reactions, more_children=more_children
+        ),
+    }
+    if paginated:
+        response["has_more"] = has_more
+    return jsonify(response), 200
+
+
+@comments.route("/comments/<cid>/children", methods=["GET"])
+def get_comment_children(cid):
+    comment = Comments.query.filter_by(id=cid).first()
+    if not comment:
+        return jsonify({"message": "Invalid Comment"}), 400
+    window = _get_tree_window()
+    if not window:
+        return jsonify({"message": "Invalid Request"}), 400
+    limit, offset, depth = window
+    cur_user = current_user.id if current_user.is_authenticated else None
+    children, more_children, has_more = CommentInfo.get_subtree(
+        comment.post_id, parent_id=comment.id, limit=limit, offset=offset, depth=depth
+    )
     return (
         jsonify(
             {
-                "post_info": post_info.as_dict(cur_user),
-                "comment_info": create_comment_tree(comments=comments, cur_user=cur_user) if comments else [],
+                "comment_info": create_comment_tree(
+                    comments=children, cur_user=cur_user, more_children=more_children
+                ),
+                "has_more": has_more,
             }
         ),
         200,
@@ -50,11 +98,15 @@ def delete_comment(cid):
         return jsonify({"message": "Invalid Comment"}), 400
     elif comment.user_id == current_user.id or current_user.has_role("admin"):
         Comments.query.filter_by(id=cid).delete()
+        # Bulk deletes skip the session's flush hooks, so drop the cached pages here.
+        invalidate_on_commit(f"subthread:{comment.post.subthread_id}", "subthreads")
         db.session.commit()
         return jsonify({"message": "Comment deleted"}), 200
     current_user_mod_in = [r.subthread_id for r in current_user.user_role if r.role.slug == "mod"]
     if comment.post.subthread_id in current_user_mod_in:
         Comments.query.filter_by(id=cid).delete()
+        # Bulk deletes skip the session's flush hooks, so drop the cached pages here.
+        invalidate_on_commit(f"subthread:{comment.post.subthread_id}", "subthreads")
         db.session.commit()
         return jsonify({"message": "Comment deleted"}), 200
     return jsonify({"message": "Unauthorized"}), 401
@@ -1,15 +1,29 @@
-def create_comment_tree(comments, cur_user=None):
-    if not comments[0]:
+from threaddit.comments.models import CommentInfo
+
+
+def create_comment_tree(comments, cur_user=None, user_reactions=None, more_children=None):
+    if not comments:
         return []
-    comment_dict = {}
+    if cur_user and user_reactions is None:
+        user_reactions = CommentInfo.get_user_reactions([c.comment_id for c in comments], cur_user)
+    comment_dict = {
+        comment.comment_id: {"comment": comment.as_dict(cur_user, user_reactions), "children": []}
+        for comment in comments
+    }
+    # Replies that were not loaded (depth cut-off) are reported as a count so the
+    # client can fetch them through /comments/<cid>/children.
+    for comment_id, count in (more_children or {}).items():
+        if comment_id in comment_dict:
+            comment_dict[comment_id]["more_children"] = count
     root_comments = []
 
+    # Nodes are linked only after all of them exist, so a child is attached even when its
+    # parent sorts after it. Comments whose parent is not in `comments` become roots.
     for comment in comments:
-        comment_data = {"comment": comment.as_dict(cur_user), "children": []}
-        comment_dict[comment.comment_id] = comment_data
-
-        if not comment.has_parent:
+        comment_data = comment_dict[comment.comment_id]
+        parent = comment_dict.get(comment.parent_id) if comment.has_parent else None
+        if parent is not None:
+            parent["children"].append(comment_data)
+        else:
             root_comments.append(comment_data)
-        elif comment.parent_id in comment_dict:
-            comment_dict[comment.parent_id]["children"].append(comment_data)
     return root_comments
@@ -0,0 +1,27 @@
+import hashlib
+import json
+from flask import jsonify, request
+from flask_login import current_user
+
+
+def version_etag(*version):
+    """Weak ETag for the current request built from stable version markers
+    (counters, max ids, timestamps). The URL and the viewer are part of the tag,
+    so the same markers never match across pages, filters or users."""
+    viewer = current_user.id if current_user.is_authenticated else None
+    raw = json.dumps([request.full_path, viewer, *version], default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def conditional_json(payload, etag=None, status=200):
+    """jsonify ``payload`` with a weak ETag and answer 304 when it is unchanged.
+
+    Without an explicit ``etag`` the tag is a digest of the serialized body, which
+    still spares the client the download when polling an unchanged resource.
+    """
+    response = jsonify(payload)
+    response.status_code = status
+    response.set_etag(etag or hashlib.sha1(response.get_data()).hexdigest(), weak=True)
+    # Browsers must revalidate every time, so edits show up on the next poll.
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
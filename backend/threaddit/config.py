@@ -20,6 +20,17 @@ GITHUB_CLIENT_ID = env_vars.get("GITHUB_CLIENT_ID") or os.getenv("GITHUB_CLIENT_
 GITHUB_CLIENT_SECRET = env_vars.get("GITHUB_CLIENT_SECRET") or os.getenv("GITHUB_CLIENT_SECRET")
 GITHUB_REDIRECT_URI = env_vars.get("GITHUB_REDIRECT_URI") or os.getenv("GITHUB_REDIRECT_URI", "http://localhost:5000/api/auth/github/callback")
 
+# Response cache for anonymous feeds; set CACHE_REDIS_URL to share it between gunicorn workers.
+CACHE_REDIS_URL = env_vars.get("CACHE_REDIS_URL") or os.getenv("CACHE_REDIS_URL")
+CACHE_MAX_ENTRIES = int(env_vars.get("CACHE_MAX_ENTRIES") or os.getenv("CACHE_MAX_ENTRIES", 1024))
+# gunicorn worker processes (gunicorn reads WEB_CONCURRENCY itself; startup.sh exports it).
+WEB_CONCURRENCY = int(env_vars.get("WEB_CONCURRENCY") or os.getenv("WEB_CONCURRENCY", 1))
+
+# Open /api/messages/stream connections allowed per gunicorn worker; each holds a thread.
+MESSAGE_STREAM_MAX_PER_WORKER = int(
+    env_vars.get("MESSAGE_STREAM_MAX_PER_WORKER") or os.getenv("MESSAGE_STREAM_MAX_PER_WORKER", 16)
+)
+
 if not DATABASE_URI:
     raise ValueError("DATABASE_URI environment variable is required. Please set it in .env file or environment.")
 if not SECRET_KEY:
@@ -29,3 +40,8 @@ if not all([CLOUDINARY_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET]):
     print("⚠️  WARNING: Cloudinary credentials not configured. Image uploads will not work.")
     print("   To enable image uploads, set CLOUDINARY_NAME, CLOUDINARY_API_KEY, and CLOUDINARY_API_SECRET in .env file")
     print("   Community creation will still work with URL-based images.")
+
+if WEB_CONCURRENCY > 1 and not CACHE_REDIS_URL:
+    print(f"⚠️  WARNING: CACHE_REDIS_URL is not set but WEB_CONCURRENCY is {WEB_CONCURRENCY}.")
+    print("   Each worker keeps its own response cache and only invalidates its own entries,")
+    print("   so other workers can serve stale feeds until their entries expire.")
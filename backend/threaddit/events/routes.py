@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify, request
 from threaddit import db
+from threaddit.conditional import conditional_json
 from flask_login import current_user, login_required
 from threaddit.events.models import Event, EventRSVP, EventValidator, EventRSVPValidator
 from threaddit.subthreads.models import Subthread
@@ -30,7 +31,7 @@ def list_events():
         current_user_id = current_user.id if current_user.is_authenticated else None
         events_data = [event.as_dict(current_user_id) for event in events_list]
 
-        return jsonify(events_data), 200
+        return conditional_json(events_data)
     except Exception as e:
         print(f"[Events] Error listing events: {str(e)}")
         return jsonify({"message": f"Error fetching events: {str(e)}"}), 500
@@ -290,7 +291,7 @@ def list_pending_events():
         events_list = Event.query.filter_by(status="pending").order_by(Event.created_at.desc()).limit(limit).offset(offset).all()
         events_data = [event.as_dict(current_user.id) for event in events_list]
 
-        return jsonify(events_data), 200
+        return conditional_json(events_data)
     except Exception as e:
         return jsonify({"message": f"Error fetching pending events: {str(e)}"}), 500
 
@@ -0,0 +1,111 @@
+import json
+import queue
+import select
+import threading
+from sqlalchemy import event, text
+from threaddit import db
+
+NOTIFY_CHANNEL = "message_events"
+# Postgres drops NOTIFY payloads over 8000 bytes; larger events are sent without data.
+MAX_NOTIFY_PAYLOAD = 7900
+_PENDING_KEY = "message_events"
+
+
+class MessageBroker:
+    """Fans message events out to the /messages/stream connections of this process.
+
+    On Postgres, events are published with pg_notify inside the writing transaction
+    and a single LISTEN thread per worker delivers them, so every gunicorn worker
+    sees every event once it is committed. Other databases fall back to in-process
+    delivery after commit.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    @property
+    def uses_postgres(self):
+        return db.engine.dialect.name == "postgresql"
+
+    def subscribe(self, user_id):
+        self._ensure_listener()
+        subscriber = queue.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_id, event_name, data):
+        # Queues the event on the current transaction; nothing is delivered if it rolls back.
+        payload = json.dumps({"user_id": user_id, "event": event_name, "data": data}, default=str)
+        if self.uses_postgres:
+            if len(payload) > MAX_NOTIFY_PAYLOAD:
+                payload = json.dumps({"user_id": user_id, "event": event_name, "data": None})
+            db.session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": payload})
+        else:
+            db.session.info.setdefault(_PENDING_KEY, []).append(payload)
+
+    def dispatch(self, payload):
+        message = json.loads(payload)
+        with self._lock:
+            subscribers = list(self._subscribers.get(message["user_id"], ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((message["event"], message["data"]))
+            except queue.Full:
+                # A stalled client only loses events; it re-syncs on reconnect.
+                pass
+
+    def _ensure_listener(self):
+        if not self.uses_postgres or (self._listener and self._listener.is_alive()):
+            return
+        with self._lock:
+            if self._listener and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name="message-broker", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        # Started lazily from a request, so it runs in the worker process after the fork.
+        while True:
+            connection = None
+            try:
+                connection = db.engine.raw_connection()
+                connection.driver_connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                pg_connection = connection.driver_connection
+                while True:
+                    if select.select([pg_connection], [], [], 30) == ([], [], []):
+                        continue
+                    pg_connection.poll()
+                    while pg_connection.notifies:
+                        self.dispatch(pg_connection.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"[MessageBroker] Listener error, reconnecting: {str(e)}")
+                if connection is not None:
+                    connection.invalidate()
+                threading.Event().wait(5)
+
+
+broker = MessageBroker()
+
+
+@event.listens_for(db.session, "after_commit")
+def _dispatch_pending(session):
+    for payload in session.info.pop(_PENDING_KEY, []):
+        broker.dispatch(payload)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _drop_pending(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -1,5 +1,7 @@
 from threaddit import db
-from sqlalchemy import case, func, and_
+from sqlalchemy import Index, case, func, and_
+from sqlalchemy.orm import aliased, contains_eager
+from threaddit.users.models import User
 
 
 class Messages(db.Model):
@@ -18,6 +20,11 @@ class Messages(db.Model):
         primaryjoin="Messages.receiver_id == User.id",
     )
 
+    __table_args__ = (
+        Index("idx_messages_receiver_sender_seen", "receiver_id", "sender_id", "seen"),
+        Index("idx_messages_sender_receiver", "sender_id", "receiver_id"),
+    )
+
     def __init__(self, sender_id, receiver_id, content):
         self.sender_id = sender_id
         self.receiver_id = receiver_id
@@ -54,39 +61,44 @@ class Messages(db.Model):
     @classmethod
     def get_inbox(cls, user_id):
         try:
-            my_case = case(
+            # Latest message, both users and the unread count for every contact in one query
+            contact_id = case(
                 (Messages.sender_id == user_id, Messages.receiver_id),
                 else_=Messages.sender_id,
-            ).label("contact_id")
-            my_max = func.max(Messages.id).label("latest_id")
-            my_subquery = (
-                db.session.query(my_case, my_max)
+            )
+            ranked = (
+                db.session.query(
+                    Messages.id.label("message_id"),
+                    contact_id.label("contact_id"),
+                    func.row_number().over(partition_by=contact_id, order_by=Messages.id.desc()).label("rank"),
+                )
                 .filter((Messages.sender_id == user_id) | (Messages.receiver_id == user_id))
-                .group_by("contact_id")
                 .subquery()
             )
-            messages = (
-                Messages.query.join(my_subquery, my_subquery.c.latest_id == Messages.id)
+            unread = (
+                db.session.query(Messages.sender_id.label("contact_id"), func.count().label("unread_count"))
+                .filter(and_(Messages.receiver_id == user_id, Messages.seen == False))
+                .group_by(Messages.sender_id)
+                .subquery()
+            )
+            sender = aliased(User)
+            receiver = aliased(User)
+            rows = (
+                db.session.query(Messages, func.coalesce(unread.c.unread_count, 0))
+                .join(ranked, and_(ranked.c.message_id == Messages.id, ranked.c.rank == 1))
+                .join(sender, sender.id == Messages.sender_id)
+                .join(receiver, receiver.id == Messages.receiver_id)
+                .outerjoin(unread, unread.c.contact_id == ranked.c.contact_id)
+                .options(
+                    contains_eager(Messages.user_sender.of_type(sender)),
+                    contains_eager(Messages.user_receiver.of_type(receiver)),
+                )
                 .order_by(Messages.created_at.desc())
                 .all()
             )
             messages_list = []
-            for message in messages:
-                if not message:
-                    continue
-                    
+            for message, unread_count in rows:
                 contact = message.user_receiver if message.sender_id == user_id else message.user_sender
-                if not contact:
-                    continue
-                
-                unread_count = Messages.query.filter(
-                    and_(
-                        Messages.sender_id == contact.id,
-                        Messages.receiver_id == user_id,
-                        Messages.seen == False
-                    )
-                ).count()
-                
                 msg_dict = message.as_dict()
                 messages_list.append({
                     **msg_dict,
@@ -109,3 +121,14 @@ class Messages(db.Model):
             import traceback
             traceback.print_exc()
             return []
+
+
+class InboxStats(db.Model):
+    # Unread counter maintained by the inbox_stats_* triggers in schema.sql.
+    __tablename__ = "inbox_stats"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def get_unread_count(cls, user_id):
+        return db.session.query(cls.unread_count).filter_by(user_id=user_id).scalar() or 0
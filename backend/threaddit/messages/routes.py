@@ -1,13 +1,43 @@
-from threaddit.messages.models import Messages
-from flask import Blueprint, jsonify, request
+from threaddit.messages.models import InboxStats, Messages
+from threaddit.messages.broker import broker
+from flask import Blueprint, Response, jsonify, request
 from threaddit import db
+from threaddit.conditional import conditional_json, version_etag
+from threaddit.config import MESSAGE_STREAM_MAX_PER_WORKER
 from sqlalchemy import and_, or_
 from threaddit.users.models import User
 from flask_login import login_required, current_user
 from sqlalchemy import func
+import json
+import queue
+import threading
 
 messages = Blueprint("messages", __name__, url_prefix="/api")
 
+STREAM_KEEPALIVE_SECONDS = 20
+# Every open stream holds one gunicorn thread for as long as the tab is open. Past this
+# many per worker new streams get 503 and the client polls instead, so the remaining
+# threads stay free for regular API requests.
+_stream_slots = threading.BoundedSemaphore(MESSAGE_STREAM_MAX_PER_WORKER)
+
+
+def _unread_count(user_id):
+    return InboxStats.get_unread_count(user_id)
+
+
+def _publish_unread_count(user_id):
+    broker.publish(user_id, "unread_count", {"unread_count": _unread_count(user_id)})
+
+
+def _publish_seen(sender_id, message_ids=None):
+    # Read receipt for the sender's open conversation with the current user.
+    broker.publish(sender_id, "seen", {"reader": current_user.username, "message_ids": message_ids})
+
+
+def _sse(event_name, data):
+    return f"event: {event_name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
 @messages.route("/messages", methods=["POST"])
 @login_required
 def new_message():
@@ -38,6 +68,11 @@ def new_message():
             content=content,
         )
         db.session.add(new_message)
+        db.session.flush()
+        message_dict = new_message.as_dict()
+        broker.publish(receiver.id, "message", {**message_dict, "is_sent": False})
+        broker.publish(current_user.id, "message", {**message_dict, "is_sent": True})
+        _publish_unread_count(receiver.id)
         db.session.commit()
 
         db.session.refresh(new_message)
@@ -69,23 +104,7 @@ def new_message():
 @login_required
 def get_inbox():
     try:
-        inbox_data = Messages.get_inbox(current_user.id)
-
-        for conversation in inbox_data:
-            contact_username = conversation.get("sender", {}).get("username")
-            if contact_username:
-                contact = User.query.filter_by(username=contact_username).first()
-                if contact:
-                    unread_count = Messages.query.filter(
-                        and_(
-                            Messages.sender_id == contact.id,
-                            Messages.receiver_id == current_user.id,
-                            Messages.seen == False
-                        )
-                    ).count()
-                    conversation["unread_count"] = unread_count
-
-        return jsonify(inbox_data), 200
+        return conditional_json(Messages.get_inbox(current_user.id))
     except Exception as e:
         return jsonify({"message": f"Error fetching inbox: {str(e)}"}), 500
 
@@ -100,22 +119,44 @@ def get_messages(user_name):
         if other_user.id == current_user.id:
             return jsonify({"message": "Cannot get messages with yourself"}), 400
 
-        conversation_messages = Messages.query.filter(
+        after_id = request.args.get("after_id", type=int)
+        before_id = request.args.get("before_id", type=int)
+        limit = request.args.get("limit", type=int)
+        if limit is not None and limit < 1:
+            return jsonify({"message": "limit must be positive"}), 400
+
+        # Everything the other user sent is marked seen in one statement, before the
+        # page is read so the returned rows already carry seen/seen_at.
+        marked_seen = Messages.query.filter(
+            Messages.sender_id == other_user.id,
+            Messages.receiver_id == current_user.id,
+            Messages.seen == False
+        ).update({"seen": True, "seen_at": func.now()}, synchronize_session=False)
+        if marked_seen:
+            _publish_unread_count(current_user.id)
+            _publish_seen(other_user.id)
+        db.session.commit()
+
+        conversation_query = Messages.query.filter(
             or_(
                 and_(Messages.sender_id == current_user.id, Messages.receiver_id == other_user.id),
                 and_(Messages.sender_id == other_user.id, Messages.receiver_id == current_user.id)
             )
-        ).order_by(Messages.created_at.asc()).all()
-
-        has_unread = False
-        for message in conversation_messages:
-            if message.receiver_id == current_user.id and not message.seen:
-                message.seen = True
-                message.seen_at = func.now()
-                has_unread = True
-
-        if has_unread:
-            db.session.commit()
+        )
+        if after_id is not None:
+            # Newer messages only, oldest first
+            conversation_query = conversation_query.filter(Messages.id > after_id).order_by(Messages.id.asc())
+            if limit:
+                conversation_query = conversation_query.limit(limit)
+            conversation_messages = conversation_query.all()
+        elif before_id is not None or limit:
+            # A page of older messages (or the latest page), returned oldest first
+            if before_id is not None:
+                conversation_query = conversation_query.filter(Messages.id < before_id)
+            conversation_messages = conversation_query.order_by(Messages.id.desc()).limit(limit or 50).all()
+            conversation_messages.reverse()
+        else:
+            conversation_messages = conversation_query.order_by(Messages.created_at.asc()).all()
 
         messages_list = []
         for msg in conversation_messages:
@@ -137,13 +178,8 @@ def get_messages(user_name):
 @login_required
 def get_unread_count():
     try:
-        unread_count = Messages.query.filter(
-            and_(
-                Messages.receiver_id == current_user.id,
-                Messages.seen == False
-            )
-        ).count()
-        return jsonify({"unread_count": unread_count}), 200
+        unread_count = _unread_count(current_user.id)
+        return conditional_json({"unread_count": unread_count}, etag=version_etag(unread_count))
     except Exception as e:
         return jsonify({"message": f"Error fetching unread count: {str(e)}"}), 500
 
@@ -161,9 +197,55 @@ def mark_message_read(message_id):
         if not message.seen:
             message.seen = True
             message.seen_at = func.now()
+            db.session.flush()
+            _publish_unread_count(current_user.id)
+            _publish_seen(message.sender_id, [message.id])
             db.session.commit()
 
         return jsonify({"message": "Message marked as read"}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Error marking message as read: {str(e)}"}), 500
+
+@messages.route("/messages/stream")
+@login_required
+def stream_messages():
+    """Server-sent events for the current user: "message" for every message sent
+    or received, "seen" when the other participant reads the user's messages, and
+    "unread_count" whenever the unread total changes.
+
+    Answers 503 once MESSAGE_STREAM_MAX_PER_WORKER streams are open in this worker;
+    the client then falls back to polling the unread count."""
+    if not _stream_slots.acquire(blocking=False):
+        return jsonify({"message": "Too many open message streams, poll instead"}), 503, {"Retry-After": "60"}
+    try:
+        user_id = current_user.id
+        unread_count = _unread_count(user_id)
+        subscriber = broker.subscribe(user_id)
+    except Exception:
+        _stream_slots.release()
+        raise
+    # The stream can stay open for hours; don't hold a pooled connection meanwhile.
+    db.session.close()
+
+    def stream():
+        try:
+            yield _sse("unread_count", {"unread_count": unread_count})
+            while True:
+                try:
+                    event_name, data = subscriber.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event_name, data)
+        finally:
+            broker.unsubscribe(user_id, subscriber)
+
+    response = Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Runs when the server closes the response, even if the generator never started.
+    response.call_on_close(_stream_slots.release)
+    return response
@@ -6,6 +6,7 @@ from threaddit.moderation.models import DeletionHistory
 from threaddit.reports.models import Report
 from threaddit.users.models import User
 from threaddit.auth.decorators import auth_role
+from threaddit.cache import response_cache
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
 from sqlalchemy.sql import cast
@@ -313,3 +314,10 @@ def get_reports_with_details():
     except Exception as e:
         return jsonify({"message": f"Error fetching reports: {str(e)}"}), 500
 
+
+
+@moderation.route("/cache/stats", methods=["GET"])
+@login_required
+@auth_role(["admin"])
+def get_cache_stats():
+    return jsonify(response_cache.metrics()), 200
@@ -3,6 +3,10 @@ from threaddit import db, ma, app
 import uuid
 from flask import url_for
 from datetime import datetime, timedelta
+import base64
+import json
+from sqlalchemy import delete, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
 import cloudinary.uploader as uploader
 from werkzeug.utils import secure_filename
 from threaddit.subthreads.models import Subthread
@@ -126,11 +130,76 @@ class SavedPosts(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=db.func.now())
     user = db.relationship("User", back_populates="saved_post")
     post = db.relationship("Posts", back_populates="saved_post")
+    __table_args__ = (db.UniqueConstraint("user_id", "post_id", name="saved_user_id_post_id_key"),)
 
     def __init__(self, user_id, post_id):
         self.user_id = user_id
         self.post_id = post_id
 
+    @classmethod
+    def add(cls, user_id, post_id):
+        # Saving twice (or from two tabs at once) keeps the single existing row.
+        db.session.execute(
+            insert(cls)
+            .values(user_id=user_id, post_id=post_id)
+            .on_conflict_do_nothing(index_elements=["user_id", "post_id"])
+        )
+        db.session.commit()
+
+    @classmethod
+    def remove(cls, user_id, post_id):
+        # Returns False when the post was not saved.
+        result = db.session.execute(
+            delete(cls).where(cls.user_id == user_id, cls.post_id == post_id).returning(cls.id)
+        )
+        removed = result.first() is not None
+        db.session.commit()
+        return removed
+
+
+class PostStats(db.Model):
+    # Counters are maintained by the post_stats_* triggers in schema.sql.
+    __tablename__ = "post_stats"
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), primary_key=True)
+    karma = db.Column(db.Integer, nullable=False, default=0)
+    comments_count = db.Column(db.Integer, nullable=False, default=0)
+    needs_rescore = db.Column(db.Boolean, nullable=False, default=True)
+    activity = db.Column(db.Float)
+
+    @classmethod
+    def rescore_hot(cls, batch_size=1000):
+        # Recompute posts.hot_score only for posts whose counters changed since the last run.
+        # Rows locked by in-flight votes/comments are skipped and picked up on the next pass.
+        total = 0
+        while True:
+            result = db.session.execute(
+                text(
+                    """
+                    WITH dirty AS (
+                        SELECT post_id FROM post_stats
+                        WHERE needs_rescore
+                        ORDER BY post_id
+                        LIMIT :batch_size
+                        FOR UPDATE SKIP LOCKED
+                    ), cleared AS (
+                        UPDATE post_stats s SET needs_rescore = FALSE
+                        FROM dirty
+                        WHERE s.post_id = dirty.post_id
+                        RETURNING s.post_id, s.karma, s.activity
+                    )
+                    UPDATE posts p
+                    SET hot_score = post_hot_score(cleared.karma, cleared.activity)
+                    FROM cleared
+                    WHERE p.id = cleared.post_id
+                    """
+                ),
+                {"batch_size": batch_size},
+            )
+            db.session.commit()
+            total += result.rowcount
+            if result.rowcount < batch_size:
+                return total
+
 
 class PostInfo(db.Model):
     __tablename__ = "post_info"
@@ -148,11 +217,12 @@ class PostInfo(db.Model):
     user_avatar = db.Column(db.Text)
     post_karma = db.Column(db.Integer)
     comments_count = db.Column(db.Integer)
+    hot_score = db.Column(db.Float)
     post = db.relationship("Posts", back_populates="post_info")
     subthread = db.relationship("Subthread", back_populates="post_info")
     user = db.relationship("User", back_populates="post_info")
 
-    def as_dict(self, cur_user=None):
+    def as_dict(self, cur_user=None, user_state=None):
         p_info = {
             "user_info": {
                 "user_name": self.user_name,
@@ -175,13 +245,37 @@ class PostInfo(db.Model):
             },
         }
         if cur_user:
-            has_reaction = Reactions.query.filter_by(post_id=self.post_id, user_id=cur_user).first()
+            if user_state is None:
+                user_state = PostInfo.get_user_state([self.post_id], cur_user)
+            reactions, saved = user_state
             p_info["current_user"] = {
-                "has_upvoted": has_reaction.is_upvote if has_reaction else None,
-                "saved": bool(SavedPosts.query.filter_by(user_id=cur_user, post_id=self.post_id).first()),
+                "has_upvoted": reactions.get(self.post_id),
+                "saved": self.post_id in saved,
             }
         return p_info
 
+    @classmethod
+    def bulk_as_dict(cls, post_infos, cur_user=None):
+        user_state = None
+        if cur_user and post_infos:
+            user_state = cls.get_user_state([p.post_id for p in post_infos], cur_user)
+        return [p.as_dict(cur_user, user_state) for p in post_infos]
+
+    @staticmethod
+    def get_user_state(post_ids, cur_user):
+        reactions = dict(
+            db.session.query(Reactions.post_id, Reactions.is_upvote).filter(
+                Reactions.user_id == cur_user, Reactions.post_id.in_(post_ids)
+            )
+        )
+        saved = {
+            row.post_id
+            for row in db.session.query(SavedPosts.post_id).filter(
+                SavedPosts.user_id == cur_user, SavedPosts.post_id.in_(post_ids)
+            )
+        }
+        return reactions, saved
+
 
 def doesSubthreadExist(subthread_id):
     if not Subthread.query.filter_by(id=subthread_id).first():
@@ -201,11 +295,11 @@ def get_filters(sortby, duration):
     sortBy, durationBy = None, None
     match sortby:
         case "top":
-            sortBy = PostInfo.post_karma.desc()
+            sortBy = PostInfo.post_karma
         case "new":
-            sortBy = PostInfo.created_at.desc()
+            sortBy = PostInfo.created_at
         case "hot":
-            sortBy = PostInfo.comments_count.desc()
+            sortBy = PostInfo.hot_score
         case _:
             raise Exception("Invalid Sortby Request")
     match duration:
@@ -222,3 +316,62 @@ def get_filters(sortby, duration):
         case _:
             raise Exception("Invalid Duration Request")
     return sortBy, durationBy
+
+
+# Largest page the feed and saved-post endpoints return, whatever ?limit= asks for.
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort_column=None):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(key, list) or len(key) != 2:
+            raise ValueError("cursor must encode [sort value, id]")
+        sort_value, row_id = key
+        # Only scalars reach the query, coerced to the column's type so the driver
+        # never sees a list, an object or a value Postgres can't compare.
+        if not isinstance(sort_value, (str, int, float)) or not isinstance(row_id, (str, int)):
+            raise ValueError("cursor values must be scalars")
+        if sort_column is not None:
+            python_type = sort_column.type.python_type
+            sort_value = datetime.fromisoformat(sort_value) if python_type is datetime else python_type(sort_value)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError, NotImplementedError) as e:
+        raise ValidationError("Invalid cursor") from e
+
+
+def page_window(limit, offset):
+    """Validate a requested page and cap its size at MAX_PAGE_SIZE."""
+    if limit < 1 or offset < 0:
+        raise ValidationError("Invalid limit or offset")
+    return min(limit, MAX_PAGE_SIZE), offset
+
+
+def paginate_posts(query, sortBy, limit, offset=0, cursor=None):
+    """Order a PostInfo query by ``sortBy`` (descending, ties broken by post id)
+    and return one page of rows plus the cursor for the next page.
+
+    With a cursor the page starts right after the encoded (sort value, post id)
+    key, so Postgres never scans the rows of earlier pages; otherwise the legacy
+    offset is applied.
+    """
+    limit, offset = page_window(limit, offset)
+    query = query.order_by(sortBy.desc(), PostInfo.post_id.desc())
+    if cursor:
+        sort_value, post_id = decode_cursor(cursor, sortBy)
+        query = query.filter(tuple_(sortBy, PostInfo.post_id) < (sort_value, post_id))
+    else:
+        query = query.offset(offset)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], sortBy.key), rows[-1].post_id) if rows else None
+    return rows, next_cursor
@@ -1,22 +1,44 @@
+import time
+import click
 from flask import Blueprint, jsonify, request
 from threaddit import db
+from threaddit.cache import cache_tags, invalidate_on_commit, response_cache
+from threaddit.conditional import conditional_json
 from flask_login import current_user, login_required
 from threaddit.posts.models import (
     PostInfo,
     Posts,
     PostValidator,
+    PostStats,
     get_filters,
+    paginate_posts,
+    decode_cursor,
+    encode_cursor,
+    page_window,
     SavedPosts,
 )
+from sqlalchemy import tuple_
 from threaddit.subthreads.models import Subscription, SubthreadInfo
 
 posts = Blueprint("posts", __name__, url_prefix="/api")
 
 
-@posts.route("/posts/<feed_name>", methods=["GET"])
-def get_posts(feed_name):
+def _feed_response(query, sortBy):
+    # Clients that send ?cursor= (empty for the first page) get keyset pagination and
+    # a {"posts", "next_cursor"} envelope; everyone else keeps the limit/offset list.
     limit = request.args.get("limit", default=20, type=int)
     offset = request.args.get("offset", default=0, type=int)
+    cursor = request.args.get("cursor", type=str)
+    post_infos, next_cursor = paginate_posts(query, sortBy, limit, offset=offset, cursor=cursor)
+    post_list = PostInfo.bulk_as_dict(post_infos, current_user.id if current_user.is_authenticated else None)
+    if cursor is None:
+        return conditional_json(post_list)
+    return conditional_json({"posts": post_list, "next_cursor": next_cursor})
+
+
+@posts.route("/posts/<feed_name>", methods=["GET"])
+@response_cache.cached(ttl=30)
+def get_posts(feed_name):
     sortby = request.args.get("sortby", default="top", type=str)
     duration = request.args.get("duration", default="alltime", type=str)
     try:
@@ -26,21 +48,13 @@ def get_posts(feed_name):
     if feed_name == "home" and current_user.is_authenticated:
         threads = [subscription.subthread.id for subscription in Subscription.query.filter_by(user_id=current_user.id)]
     elif feed_name == "all":
-        threads = (thread.id for thread in SubthreadInfo.query.order_by(SubthreadInfo.members_count.desc()).limit(25))
+        threads = [thread.id for thread in SubthreadInfo.query.order_by(SubthreadInfo.members_count.desc()).limit(25)]
     elif feed_name == "popular":
-        threads = (thread.id for thread in SubthreadInfo.query.order_by(SubthreadInfo.posts_count.desc()).limit(25))
+        threads = [thread.id for thread in SubthreadInfo.query.order_by(SubthreadInfo.posts_count.desc()).limit(25)]
     else:
         return jsonify({"message": "Invalid Request"}), 400
-    post_list = [
-        pinfo.as_dict(cur_user=current_user.id if current_user.is_authenticated else None)
-        for pinfo in PostInfo.query.filter(PostInfo.thread_id.in_(threads))
-        .order_by(sortBy)
-        .filter(durationBy)
-        .limit(limit)
-        .offset(offset)
-        .all()
-    ]
-    return jsonify(post_list), 200
+    cache_tags(*(f"subthread:{thread_id}" for thread_id in threads))
+    return _feed_response(PostInfo.query.filter(PostInfo.thread_id.in_(threads)).filter(durationBy), sortBy)
 
 
 @posts.route("/post/<pid>", methods=["GET"])
@@ -169,12 +183,16 @@ def delete_post(pid):
     elif post.user_id == current_user.id or current_user.has_role("admin"):
         post.delete_media()
         Posts.query.filter_by(id=pid).delete()
+        # Bulk deletes skip the session's flush hooks, so drop the cached pages here.
+        invalidate_on_commit(f"subthread:{post.subthread_id}", "subthreads")
         db.session.commit()
         return jsonify({"message": "Post deleted"}), 200
     current_user_mod_in = [r.subthread_id for r in current_user.user_role if r.role.slug == "mod"]
     if post.subthread_id in current_user_mod_in:
         post.delete_media()
         Posts.query.filter_by(id=pid).delete()
+        # Bulk deletes skip the session's flush hooks, so drop the cached pages here.
+        invalidate_on_commit(f"subthread:{post.subthread_id}", "subthreads")
         db.session.commit()
         return jsonify({"message": "Post deleted"}), 200
     return jsonify({"message": "Unauthorized"}), 401
@@ -182,46 +200,24 @@ def delete_post(pid):
 
 @posts.route("/posts/thread/<tid>", methods=["GET"])
 def get_posts_of_thread(tid):
-    limit = request.args.get("limit", default=20, type=int)
-    offset = request.args.get("offset", default=0, type=int)
     sortby = request.args.get("sortby", default="top", type=str)
     duration = request.args.get("duration", default="alltime", type=str)
     try:
         sortBy, durationBy = get_filters(sortby=sortby, duration=duration)
     except Exception:
         return jsonify({"message": "Invalid Request"}), 400
-    post_list = [
-        pinfo.as_dict(current_user.id if current_user.is_authenticated else None)
-        for pinfo in PostInfo.query.filter(PostInfo.thread_id == tid)
-        .order_by(sortBy)
-        .filter(durationBy)
-        .limit(limit)
-        .offset(offset)
-        .all()
-    ]
-    return jsonify(post_list), 200
+    return _feed_response(PostInfo.query.filter(PostInfo.thread_id == tid).filter(durationBy), sortBy)
 
 
 @posts.route("/posts/user/<user_name>", methods=["GET"])
 def get_posts_of_user(user_name):
-    limit = request.args.get("limit", default=20, type=int)
-    offset = request.args.get("offset", default=0, type=int)
     sortby = request.args.get("sortby", default="top", type=str)
     duration = request.args.get("duration", default="alltime", type=str)
     try:
         sortBy, durationBy = get_filters(sortby=sortby, duration=duration)
     except Exception:
         return jsonify({"message": "Invalid Request"}), 400
-    post_list = [
-        pinfo.as_dict(current_user.id if current_user.is_authenticated else None)
-        for pinfo in PostInfo.query.filter(PostInfo.user_name == user_name)
-        .order_by(sortBy)
-        .filter(durationBy)
-        .limit(limit)
-        .offset(offset)
-        .all()
-    ]
-    return jsonify(post_list), 200
+    return _feed_response(PostInfo.query.filter(PostInfo.user_name == user_name).filter(durationBy), sortBy)
 
 
 @posts.route("/posts/saved", methods=["GET"])
@@ -229,29 +225,52 @@ def get_posts_of_user(user_name):
 def get_saved():
     limit = request.args.get("limit", default=20, type=int)
     offset = request.args.get("offset", default=0, type=int)
-    saved_posts = SavedPosts.query.filter(SavedPosts.user_id == current_user.id).offset(offset).limit(limit).all()
-    post_infos = [PostInfo.query.filter_by(post_id=pid.post_id) for pid in saved_posts]
-    return (
-        jsonify([p.first().as_dict(current_user.id) for p in post_infos]),
-        200,
+    cursor = request.args.get("cursor", type=str)
+    limit, offset = page_window(limit, offset)
+    saved_query = SavedPosts.query.filter(SavedPosts.user_id == current_user.id).order_by(
+        SavedPosts.created_at.desc(), SavedPosts.id.desc()
     )
+    if cursor:
+        created_at, saved_id = decode_cursor(cursor, SavedPosts.created_at)
+        saved_query = saved_query.filter(tuple_(SavedPosts.created_at, SavedPosts.id) < (created_at, saved_id))
+    else:
+        saved_query = saved_query.offset(offset)
+    saved_posts = saved_query.limit(limit + 1).all()
+    next_cursor = None
+    if len(saved_posts) > limit:
+        saved_posts = saved_posts[:limit]
+        next_cursor = encode_cursor(saved_posts[-1].created_at, saved_posts[-1].id) if saved_posts else None
+    post_ids = [saved.post_id for saved in saved_posts]
+    infos_by_id = {p.post_id: p for p in PostInfo.query.filter(PostInfo.post_id.in_(post_ids)).all()} if post_ids else {}
+    post_infos = [infos_by_id[pid] for pid in post_ids if pid in infos_by_id]
+    post_list = PostInfo.bulk_as_dict(post_infos, current_user.id)
+    if cursor is None:
+        return conditional_json(post_list)
+    return conditional_json({"posts": post_list, "next_cursor": next_cursor})
 
 
 @posts.route("/posts/saved/<pid>", methods=["DELETE"])
 @login_required
 def delete_saved(pid):
-    saved_post = SavedPosts.query.filter_by(user_id=current_user.id, post_id=pid).first()
-    if not saved_post:
+    if not SavedPosts.remove(current_user.id, pid):
         return jsonify({"message": "Invalid Post ID"}), 400
-    SavedPosts.query.filter_by(user_id=current_user.id, post_id=pid).delete()
-    db.session.commit()
     return jsonify({"message": "Saved Post deleted"}), 200
 
 
 @posts.route("/posts/saved/<pid>", methods=["PUT"])
 @login_required
 def new_saved(pid):
-    new_saved = SavedPosts(user_id=current_user.id, post_id=pid)
-    db.session.add(new_saved)
-    db.session.commit()
+    SavedPosts.add(current_user.id, pid)
     return jsonify({"message": "Saved"}), 200
+
+
+@posts.cli.command("rescore-hot")
+@click.option("--interval", default=0, type=int, help="Seconds between passes; 0 runs a single pass.")
+@click.option("--batch-size", default=1000, type=int)
+def rescore_hot(interval, batch_size):
+    while True:
+        rescored = PostStats.rescore_hot(batch_size=batch_size)
+        click.echo(f"[Posts] Rescored {rescored} hot posts")
+        if interval <= 0:
+            return
+        time.sleep(interval)
@@ -8,7 +8,7 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field, validator
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  
-from rag_retriever import ask_rag
+from rag_retriever import ask_rag, retriever_status
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -82,7 +82,8 @@ def health():
                 "api": "ok",
                 "database": "ok",  
                 "openai": "ok"    
-            }
+            },
+            "retriever": retriever_status()
         }
     except Exception as e:
         logger.error(f"Health check failed: {e}")
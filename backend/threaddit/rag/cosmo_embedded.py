@@ -1,5 +1,6 @@
 import os
 import json
+from datetime import datetime, timezone
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 from pymongo import MongoClient
@@ -138,6 +139,7 @@ def process_and_upload():
     folder = os.path.join(script_dir, "docs")
 
     print("\n Starting embedding upload to CosmosDB...\n")
+    collection.create_index("updated_at")
 
     for filename in os.listdir(folder):
         if not filename.endswith(".json"):
@@ -176,7 +178,9 @@ def process_and_upload():
                 "text": chunk,
                 "embedding": embedding,
                 "chunk_index": i,
-                "total_chunks": len(text_chunks)
+                "total_chunks": len(text_chunks),
+                # rag_retriever rebuilds its in-memory index when the newest stamp changes
+                "updated_at": datetime.now(timezone.utc)
             }
 
             collection.update_one(
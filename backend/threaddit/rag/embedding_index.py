@@ -0,0 +1,506 @@
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METADATA_FIELDS = ("id", "source", "text", "chunk_index", "total_chunks")
+STORE_FIELDS = ("id", "source", "chunk_index", "total_chunks")
+VECTORS_FILE = "vectors.npy"
+TEXTS_FILE = "texts.txt"
+SIDECAR_FILE = "meta.json"
+IVF_FILE = "ivf.npz"
+
+
+class TextStore:
+    # Chunk texts of an exported index, read on demand from a memory-mapped UTF-8 file.
+
+    def __init__(self, path: str, offsets: List[Tuple[int, int]]):
+        self.offsets = offsets
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+
+    def __getitem__(self, i: int) -> str:
+        offset, length = self.offsets[i]
+        return self._buffer[offset:offset + length].decode("utf-8")
+
+
+class EmbeddingIndex:
+    # Every chunk embedding as one contiguous, L2-normalized float32 matrix, with the
+    # chunk metadata in a parallel list, so a query is a single matrix-vector product.
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        metadata: List[Dict[str, Any]],
+        fingerprint: Any = None,
+        normalized: bool = False,
+        texts: Optional[TextStore] = None,
+    ):
+        if vectors.ndim != 2 or len(vectors) != len(metadata):
+            raise ValueError("vectors must be a 2-D matrix with one row per metadata entry")
+        if not normalized:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors = vectors / norms
+        self.vectors = vectors
+        self.metadata = metadata
+        self.fingerprint = fingerprint
+        self.texts = texts
+
+    @property
+    def dimension(self) -> int:
+        return self.vectors.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    @classmethod
+    def from_collection(cls, collection, batch_size: int = 500) -> "EmbeddingIndex":
+        start = time.time()
+        fingerprint = collection_fingerprint(collection)
+        projection = {field: 1 for field in METADATA_FIELDS}
+        projection.update({"embedding": 1, "_id": 0})
+        # Rows go straight into a float32 matrix sized from the fingerprint count, so at
+        # most one cursor batch of embeddings is ever held as Python floats.
+        vectors, metadata, dimension = None, [], None
+        for doc in collection.find({"embedding": {"$exists": True}}, projection).batch_size(batch_size):
+            embedding = doc.pop("embedding", None)
+            if not embedding:
+                continue
+            if dimension is None:
+                dimension = len(embedding)
+                vectors = np.empty((max(fingerprint[0], 1), dimension), dtype=np.float32)
+            if len(embedding) != dimension:
+                logger.warning(f"Skipping {doc.get('id')}: embedding dimension {len(embedding)} != {dimension}")
+                continue
+            if len(metadata) == len(vectors):
+                # Chunks were added after the count; grow by half rather than per row.
+                grown = np.empty((len(vectors) + len(vectors) // 2 + 1, dimension), dtype=np.float32)
+                grown[:len(vectors)] = vectors
+                vectors = grown
+            vectors[len(metadata)] = embedding
+            metadata.append({field: doc.get(field) for field in METADATA_FIELDS})
+        if vectors is None:
+            vectors = np.empty((0, 0), dtype=np.float32)
+        vectors = vectors[:len(metadata)]
+        normalize_rows(vectors)
+        index = cls(vectors, metadata, fingerprint, normalized=True)
+        logger.info(f"Loaded embedding index: {len(index)} chunks in {time.time() - start:.2f}s")
+        return index
+
+    def export(self, path: str) -> None:
+        # Publishes the index as a new version directory behind the `path` symlink (see
+        # publish_export).
+        publish_export(path, self.write_files)
+        logger.info(f"Exported embedding index: {len(self)} chunks to {path}")
+
+    def write_files(self, directory: str) -> None:
+        # vectors.npy (normalized float32 matrix), texts.txt (UTF-8 chunk texts) and
+        # meta.json (per-chunk metadata with text offsets).
+        texts, offsets, position = [], [], 0
+        for i, meta in enumerate(self.metadata):
+            encoded = (self.texts[i] if self.texts is not None else meta.get("text") or "").encode("utf-8")
+            texts.append(encoded)
+            offsets.append((position, len(encoded)))
+            position += len(encoded)
+        sidecar = {
+            "fingerprint": self.fingerprint,
+            "dimension": self.dimension,
+            "chunks": [
+                dict({field: meta.get(field) for field in STORE_FIELDS}, text_offset=offset, text_length=length)
+                for meta, (offset, length) in zip(self.metadata, offsets)
+            ],
+        }
+        vectors = np.ascontiguousarray(self.vectors, dtype=np.float32)
+        _write_file(os.path.join(directory, VECTORS_FILE), lambda f: np.save(f, vectors))
+        _write_file(os.path.join(directory, TEXTS_FILE), lambda f: f.writelines(texts))
+        encoded_sidecar = json.dumps(sidecar, default=str).encode("utf-8")
+        _write_file(os.path.join(directory, SIDECAR_FILE), lambda f: f.write(encoded_sidecar))
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingIndex":
+        # Memory-maps an exported index read-only, so every worker shares one page-cache
+        # copy and loading costs only the sidecar parse. The symlink is resolved once and
+        # every file is read from that version directory, which is never modified.
+        directory = os.path.realpath(path)
+        with open(os.path.join(directory, SIDECAR_FILE), "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+        chunks = sidecar["chunks"]
+        if len(vectors) != len(chunks):
+            raise ValueError(f"{directory} has {len(vectors)} vectors but its sidecar lists {len(chunks)} chunks")
+        metadata = [{field: chunk.get(field) for field in STORE_FIELDS} for chunk in chunks]
+        texts = TextStore(
+            os.path.join(directory, TEXTS_FILE), [(chunk["text_offset"], chunk["text_length"]) for chunk in chunks]
+        )
+        logger.info(f"Memory-mapped embedding index: {len(metadata)} chunks from {directory}")
+        return cls(vectors, metadata, directory, normalized=True, texts=texts)
+
+    def search(self, q_emb: List[float], k: int) -> List[Dict[str, Any]]:
+        if not len(self) or k <= 0:
+            return []
+        query = np.asarray(q_emb, dtype=np.float32)
+        if query.shape != (self.dimension,):
+            raise ValueError(f"Query dimension {query.shape[-1]} does not match index dimension {self.dimension}")
+        norm = np.linalg.norm(query)
+        if norm == 0 or not np.isfinite(norm):
+            return []
+        scores = self.vectors @ (query / norm)
+        return [self._result(i, scores[i]) for i in top_k_indices(scores, k)]
+
+    def take(self, rows: np.ndarray) -> "EmbeddingIndex":
+        # Copy of the index holding only `rows`, in that order.
+        texts = [self.texts[i] for i in rows] if self.texts is not None else None
+        metadata = [dict(self.metadata[i], text=texts[n]) if texts else self.metadata[i] for n, i in enumerate(rows)]
+        return EmbeddingIndex(np.asarray(self.vectors[rows]), metadata, self.fingerprint, normalized=True)
+
+    def _result(self, i: int, score: float) -> Dict[str, Any]:
+        result = dict(self.metadata[i], score=float(score))
+        if self.texts is not None:
+            result["text"] = self.texts[i]
+        return result
+
+
+def _write_file(path: str, write) -> None:
+    with open(path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def export_directory(path: str) -> Optional[str]:
+    # The version directory `path` currently points at, or None without an export.
+    directory = os.path.realpath(path)
+    return directory if os.path.exists(os.path.join(directory, SIDECAR_FILE)) else None
+
+
+def publish_export(path: str, write, keep: int = 2) -> str:
+    # Writes a complete export into a new version directory next to `path`, then points
+    # the `path` symlink at it with one atomic rename. Readers resolve the link once per
+    # load, so they never pair files from two exports. The newest `keep` versions stay
+    # on disk; older ones are removed (workers that still map them keep their pages).
+    path = os.path.abspath(path)
+    parent, name = os.path.split(path)
+    version = f"{name}.v{time.time_ns()}"
+    directory = os.path.join(parent, version)
+    os.makedirs(directory)
+    try:
+        write(directory)
+    except Exception:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    link = os.path.join(parent, f".{version}.link")
+    os.symlink(version, link)
+    os.replace(link, path)
+    versions = sorted(entry for entry in os.listdir(parent) if entry.startswith(f"{name}.v"))
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(parent, old), ignore_errors=True)
+    return directory
+
+
+def normalize_rows(vectors: np.ndarray, batch_size: int = 65_536) -> None:
+    # L2-normalizes a float32 matrix in place, batch by batch, without a full-size copy.
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        norms = np.linalg.norm(batch, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        batch /= norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition selects the k best in O(n); only those k are then sorted.
+    if k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    iterations: int = 20,
+    sample_size: int = 100_000,
+    batch_size: int = 65_536,
+    seed: int = 0,
+) -> np.ndarray:
+    # Spherical k-means (cosine) trained on a sample of at most sample_size rows;
+    # returns L2-normalized centroids. Empty clusters are reseeded from random rows.
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign_clusters(sample, centroids, batch_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_clusters)
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids
+
+
+def assign_clusters(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65_536) -> np.ndarray:
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        labels[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    # Inverted-file ANN index: rows are grouped by their nearest k-means centroid and
+    # stored cluster after cluster, so a query scores the centroids and then only the
+    # contiguous row ranges of the nprobe closest clusters. nprobe trades recall for
+    # latency; nprobe == n_clusters is an exact search.
+
+    def __init__(self, base: EmbeddingIndex, centroids: np.ndarray, offsets: np.ndarray, nprobe: int = 8):
+        if offsets[-1] != len(base) or len(offsets) != len(centroids) + 1:
+            raise ValueError("IVF cluster offsets do not match the embedding index")
+        self.base = base
+        self.centroids = centroids
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @property
+    def fingerprint(self) -> Any:
+        return self.base.fingerprint
+
+    @property
+    def n_clusters(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    @classmethod
+    def build(
+        cls, index: EmbeddingIndex, n_clusters: Optional[int] = None, nprobe: int = 8, **kmeans_options
+    ) -> "IVFIndex":
+        start = time.time()
+        if n_clusters is None:
+            n_clusters = int(4 * np.sqrt(len(index)))
+        n_clusters = min(max(1, n_clusters), len(index))
+        centroids = kmeans(index.vectors, n_clusters, **kmeans_options) if len(index) else np.empty((0, 0), np.float32)
+        labels = assign_clusters(index.vectors, centroids) if len(index) else np.empty(0, np.int64)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_clusters)))).astype(np.int64)
+        ivf = cls(index.take(order), centroids, offsets, nprobe)
+        logger.info(f"Built IVF index: {len(ivf)} chunks in {n_clusters} clusters in {time.time() - start:.2f}s")
+        return ivf
+
+    def save(self, path: str) -> None:
+        # The clusters are published in the same version directory as the rows they
+        # index, so a later plain export simply serves exact search again.
+        def write_files(directory: str) -> None:
+            self.base.write_files(directory)
+            _write_file(
+                os.path.join(directory, IVF_FILE),
+                lambda f: np.savez(f, centroids=self.centroids, offsets=self.offsets),
+            )
+
+        publish_export(path, write_files)
+        logger.info(f"Exported IVF index: {len(self)} chunks in {self.n_clusters} clusters to {path}")
+
+    @classmethod
+    def load(cls, path: str, nprobe: int = 8) -> "IVFIndex":
+        directory = os.path.realpath(path)
+        base = EmbeddingIndex.load(directory)
+        with np.load(os.path.join(directory, IVF_FILE)) as stored:
+            return cls(base, stored["centroids"], stored["offsets"], nprobe)
+
+    def search(self, q_emb: List[float], k: int, nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        if not len(self) or k <= 0:
+            return []
+        query = np.asarray(q_emb, dtype=np.float32)
+        if query.shape != (self.base.dimension,):
+            raise ValueError(f"Query dimension {query.shape[-1]} does not match index dimension {self.base.dimension}")
+        norm = np.linalg.norm(query)
+        if norm == 0 or not np.isfinite(norm):
+            return []
+        query = query / norm
+        clusters = top_k_indices(self.centroids @ query, min(nprobe or self.nprobe, self.n_clusters))
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in clusters])
+        scores = np.concatenate([self.base.vectors[self.offsets[c]:self.offsets[c + 1]] @ query for c in clusters])
+        return [self.base._result(rows[i], scores[i]) for i in top_k_indices(scores, k)]
+
+
+def benchmark(
+    ivf: IVFIndex, k: int = 10, nprobes: Tuple[int, ...] = (1, 2, 4, 8, 16, 32), queries: int = 200, seed: int = 0
+) -> List[Dict[str, Any]]:
+    # recall@k and mean latency of the IVF search against exact search over the same
+    # rows. Queries are stored chunks with gaussian noise, a stand-in for real questions.
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(ivf), min(queries, len(ivf)), replace=False)
+    sample = np.asarray(ivf.base.vectors[np.sort(rows)], dtype=np.float32)
+    sample += rng.normal(scale=0.5 / np.sqrt(ivf.base.dimension), size=sample.shape).astype(np.float32)
+
+    def timed(search):
+        start = time.perf_counter()
+        results = [{hit["id"] for hit in search(q)} for q in sample]
+        return results, (time.perf_counter() - start) * 1000 / len(sample)
+
+    exact, exact_ms = timed(lambda q: ivf.base.search(q, k))
+    report = [{"nprobe": "exact", "recall": 1.0, "latency_ms": round(exact_ms, 3)}]
+    for nprobe in nprobes:
+        approx, ms = timed(lambda q: ivf.search(q, k, nprobe=nprobe))
+        recall = np.mean([len(a & e) / max(len(e), 1) for a, e in zip(approx, exact)])
+        report.append({"nprobe": nprobe, "recall": round(float(recall), 4), "latency_ms": round(ms, 3)})
+    return report
+
+
+def collection_fingerprint(collection) -> Tuple[int, Optional[Any]]:
+    # Chunk count plus the newest updated_at stamp set by cosmo_embedded.py; cheap enough
+    # to poll, and it changes whenever chunks are added, removed or re-embedded.
+    count = collection.count_documents({"embedding": {"$exists": True}})
+    newest = collection.find_one(
+        {"updated_at": {"$exists": True}}, {"updated_at": 1, "_id": 0}, sort=[("updated_at", -1)]
+    )
+    return count, newest.get("updated_at") if newest else None
+
+
+class IndexHolder:
+    # Keeps one EmbeddingIndex per process and rebuilds it when its source changes. With
+    # a path to an exported index the source is that file (no Mongo reads at all), served
+    # through IVFIndex when `build-ivf` wrote clusters next to it; otherwise it is the
+    # collection. start() loads the first index in the background at startup; afterwards
+    # the source is checked at most every refresh_interval seconds, again on a background
+    # thread, and the new index is swapped in once built, so no query waits on a rebuild.
+
+    def __init__(
+        self,
+        collection,
+        refresh_interval: float = 60,
+        path: Optional[str] = None,
+        nprobe: int = 8,
+        load_timeout: float = 60,
+    ):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.path = path
+        self.nprobe = nprobe
+        self.load_timeout = load_timeout
+        self._index = None
+        self._checked_at = 0.0
+        self._load_error: Optional[str] = None
+        self._first_attempt_done = threading.Event()
+        self._job_lock = threading.Lock()
+
+    def start(self) -> None:
+        self._run_in_background(self._load_initial)
+
+    def get(self):
+        if self._index is None:
+            # After a failed load, retry at most every refresh_interval and fail fast
+            # meanwhile; only queries arriving before the first attempt ends wait for it.
+            if self._load_error is None or time.time() - self._checked_at >= self.refresh_interval:
+                self.start()
+            if self._load_error is None:
+                self._first_attempt_done.wait(self.load_timeout)
+            if self._index is None:
+                raise RuntimeError(f"Embedding index is not loaded: {self._load_error or 'still loading'}")
+        elif time.time() - self._checked_at >= self.refresh_interval:
+            self._run_in_background(self._refresh)
+        return self._index
+
+    def _run_in_background(self, job) -> None:
+        # One load or refresh at a time; callers never block on it.
+        if self._job_lock.acquire(blocking=False):
+            threading.Thread(target=self._run_job, args=(job,), name="embedding-index", daemon=True).start()
+
+    def _run_job(self, job) -> None:
+        try:
+            job()
+        finally:
+            self._job_lock.release()
+
+    def _load_initial(self) -> None:
+        if self._index is not None:
+            return
+        try:
+            self._index = self._load()
+            self._load_error = None
+        except Exception as e:
+            self._load_error = str(e)
+            logger.error(f"Embedding index load failed, retrying in {self.refresh_interval}s: {e}")
+        finally:
+            self._checked_at = time.time()
+            self._first_attempt_done.set()
+
+    def _uses_file(self) -> bool:
+        return bool(self.path) and export_directory(self.path) is not None
+
+    def _load(self):
+        directory = export_directory(self.path) if self.path else None
+        if directory is not None:
+            if os.path.exists(os.path.join(directory, IVF_FILE)):
+                return IVFIndex.load(directory, self.nprobe)
+            return EmbeddingIndex.load(directory)
+        return EmbeddingIndex.from_collection(self.collection)
+
+    def _refresh(self) -> None:
+        try:
+            if self._uses_file():
+                changed = export_directory(self.path) != self._index.fingerprint
+            else:
+                changed = collection_fingerprint(self.collection) != self._index.fingerprint
+            if changed:
+                logger.info("Embedding source changed, reloading the index")
+                self._index = self._load()
+        except Exception as e:
+            logger.warning(f"Embedding index refresh failed, keeping the current index: {e}")
+        self._checked_at = time.time()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the RAG embedding index")
+    parser.add_argument("--path", default=os.getenv("RAG_INDEX_PATH"), required=not os.getenv("RAG_INDEX_PATH"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("export", help="Export the collection's embeddings for memory-mapped loading")
+    build_parser = commands.add_parser("build-ivf", help="Export the collection with an IVF (k-means) ANN index")
+    build_parser.add_argument("--clusters", type=int, default=None, help="Defaults to 4 * sqrt(chunks)")
+    build_parser.add_argument("--iterations", type=int, default=20)
+    build_parser.add_argument("--from-export", action="store_true", help="Cluster the existing export instead of reading Mongo")
+    commands.add_parser("info", help="Load the export and describe it")
+    bench_parser = commands.add_parser("bench", help="Report IVF recall@k and latency against exact search")
+    bench_parser.add_argument("-k", type=int, default=10)
+    bench_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    bench_parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    def read_collection() -> EmbeddingIndex:
+        from dotenv import load_dotenv
+        from pymongo import MongoClient
+
+        load_dotenv()
+        client = MongoClient(os.getenv("COSMOS_MONGO_URI"))
+        return EmbeddingIndex.from_collection(
+            client[os.getenv("COSMOS_DB_NAME", "ragdb")][os.getenv("COSMOS_COLLECTION", "election_docs")]
+        )
+
+    if args.command == "export":
+        read_collection().export(args.path)
+    elif args.command == "build-ivf":
+        source = EmbeddingIndex.load(args.path) if args.from_export else read_collection()
+        IVFIndex.build(source, args.clusters, iterations=args.iterations).save(args.path)
+    elif args.command == "info":
+        ivf = os.path.exists(os.path.join(os.path.realpath(args.path), IVF_FILE))
+        index = IVFIndex.load(args.path) if ivf else EmbeddingIndex.load(args.path)
+        base = index.base if ivf else index
+        print(f"{len(index)} chunks, dimension {base.dimension if len(index) else 0}, "
+              + (f"IVF with {index.n_clusters} clusters" if ivf else "exact search only"))
+    elif args.command == "bench":
+        for row in benchmark(IVFIndex.load(args.path), args.k, args.nprobe, args.queries):
+            print(f"nprobe={row['nprobe']:>6}  recall@{args.k}={row['recall']:.4f}  {row['latency_ms']:.3f} ms/query")
@@ -1,13 +1,15 @@
 import os
-import numpy as np
 import logging
 from dotenv import load_dotenv
 from pymongo import MongoClient
 from openai import AzureOpenAI, OpenAIError
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any
 from functools import lru_cache
 import time
 import hashlib
+from embedding_index import IndexHolder
+from vector_search import VectorSearchCircuit
+from ttl_cache import TTLCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -75,30 +77,49 @@ except Exception as e:
     logger.error(f"Failed to initialize chat client: {e}")
     raise
 
-_query_cache = {}
-_cache_max_age = 300 
+# Fallback index over every chunk. With RAG_INDEX_PATH pointing at an export
+# (`python embedding_index.py export` or `build-ivf`) it is memory-mapped from disk
+# and shared by all workers; with IVF clusters only the RAG_IVF_NPROBE closest are
+# searched. Otherwise it is built from the collection and rebuilt when it changes.
+_index_holder = IndexHolder(
+    collection,
+    refresh_interval=float(os.getenv("RAG_INDEX_REFRESH_SECONDS", "60")),
+    path=os.getenv("RAG_INDEX_PATH"),
+    nprobe=int(os.getenv("RAG_IVF_NPROBE", "8")),
+)
+_index_holder.start()
+
+# $vectorSearch capability, detected once here and re-probed in the background while it
+# is unavailable or its circuit is open.
+_vector_search = VectorSearchCircuit(
+    collection,
+    failure_threshold=int(os.getenv("RAG_VECTOR_SEARCH_FAILURES", "3")),
+    probe_interval=float(os.getenv("RAG_VECTOR_SEARCH_PROBE_SECONDS", "60")),
+)
+_vector_search.probe()
+
+# Retrieved chunks (from either search path) and full answers, keyed by the normalized
+# query and k. Civic questions repeat a lot, and an answer hit skips the LLM call.
+_retrieval_cache = TTLCache(
+    max_entries=int(os.getenv("RAG_RETRIEVAL_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("RAG_RETRIEVAL_CACHE_TTL", "300")),
+)
+_answer_cache = TTLCache(
+    max_entries=int(os.getenv("RAG_ANSWER_CACHE_SIZE", "500")),
+    ttl=float(os.getenv("RAG_ANSWER_CACHE_TTL", "900")),
+)
 
 def _get_query_cache_key(query: str, k: int) -> str:
-    return hashlib.md5(f"{query.strip().lower()}_{k}".encode()).hexdigest()
+    return hashlib.md5(f"{' '.join(query.lower().split())}_{k}".encode()).hexdigest()
 
-def _get_cached_result(query: str, k: int) -> Optional[List[Dict[str, Any]]]:
-    cache_key = _get_query_cache_key(query, k)
-    if cache_key in _query_cache:
-        cached_data, timestamp = _query_cache[cache_key]
-        if time.time() - timestamp < _cache_max_age:
-            logger.info("Returning cached result")
-            return cached_data
-        else:
-            del _query_cache[cache_key]
-    return None
-
-def _cache_result(query: str, k: int, result: List[Dict[str, Any]]) -> None:
-    cache_key = _get_query_cache_key(query, k)
-    _query_cache[cache_key] = (result, time.time())
-    
-    if len(_query_cache) > 20:
-        oldest_key = min(_query_cache.keys(), key=lambda k: _query_cache[k][1])
-        del _query_cache[oldest_key]
+def retriever_status() -> Dict[str, Any]:
+    # Health polls also drive the recovery probe when no queries arrive.
+    _vector_search.available()
+    return {
+        "vector_search": _vector_search.status(),
+        "retrieval_cache": _retrieval_cache.stats(),
+        "answer_cache": _answer_cache.stats(),
+    }
 
 def check_database_status() -> Dict[str, Any]:
     try:
@@ -147,29 +168,6 @@ def embed_text(text: str) -> List[float]:
         raise
 
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    try:
-        if not a or not b or len(a) != len(b):
-            return 0.0
-        
-        a_arr, b_arr = np.array(a, dtype=np.float32), np.array(b, dtype=np.float32)
-        
-        norm_a, norm_b = np.linalg.norm(a_arr), np.linalg.norm(b_arr)
-        if norm_a == 0 or norm_b == 0 or np.isnan(norm_a) or np.isnan(norm_b):
-            return 0.0
-        
-        similarity = np.dot(a_arr, b_arr) / (norm_a * norm_b)
-        
-        if np.isnan(similarity) or np.isinf(similarity):
-            return 0.0
-        
-        return float(np.clip(similarity, -1.0, 1.0))  
-        
-    except Exception as e:
-        logger.warning(f"Error computing cosine similarity: {e}")
-        return 0.0
-
-
 def retrieve_top_k(query: str, k: int = 3) -> List[Dict[str, Any]]:
     if not query or not query.strip():
         raise ValueError("Query cannot be empty")
@@ -177,57 +175,32 @@ def retrieve_top_k(query: str, k: int = 3) -> List[Dict[str, Any]]:
     if k <= 0:
         raise ValueError("k must be positive")
     
-    cached_result = _get_cached_result(query, k)
+    cache_key = _get_query_cache_key(query, k)
+    cached_result = _retrieval_cache.get(cache_key)
     if cached_result is not None:
+        logger.info("Returning cached retrieval result")
         return cached_result
     
     try:
         q_emb = embed_text(query)
         logger.info(f"Searching for top-{k} documents for query: {query[:50]}...")
         
-        vector_search_available = False
-        try:
-            test_pipeline = [{"$vectorSearch": {"index": "test", "path": "test", "queryVector": [0.1, 0.1], "numCandidates": 1, "limit": 1}}]
-            list(collection.aggregate(test_pipeline, allowDiskUse=True))
-            vector_search_available = True
-        except Exception:
-            logger.info("Vector search not available, using manual similarity calculation")
-        
-        if vector_search_available:
+        if _vector_search.available():
             try:
-                pipeline = [
-                    {
-                        "$vectorSearch": {
-                            "index": "vector_index",
-                            "path": "embedding", 
-                            "queryVector": q_emb,
-                            "numCandidates": min(k * 10, 1000),
-                            "limit": k
-                        }
-                    },
-                    {
-                        "$project": {
-                            "id": 1,
-                            "source": 1,
-                            "text": 1,
-                            "chunk_index": 1,
-                            "total_chunks": 1,
-                            "score": {"$meta": "vectorSearchScore"}
-                        }
-                    }
-                ]
-                
-                results = list(collection.aggregate(pipeline))
+                results = list(collection.aggregate(_vector_search.pipeline(q_emb, k)))
+                _vector_search.record_success()
                 if results:
                     logger.info(f"Vector search returned {len(results)} results")
+                    _retrieval_cache.set(cache_key, results)
                     return results
             except Exception as ve:
                 logger.warning(f"Vector search failed: {ve}")
+                _vector_search.record_failure(ve)
         
         try:
             results = _manual_similarity_search(q_emb, k, query)
             if results:
-                _cache_result(query, k, results)
+                _retrieval_cache.set(cache_key, results)
             return results
         except Exception as manual_error:
             logger.error(f"Manual similarity search also failed: {manual_error}")
@@ -239,102 +212,13 @@ def retrieve_top_k(query: str, k: int = 3) -> List[Dict[str, Any]]:
 
 
 def _manual_similarity_search(q_emb: List[float], k: int, query: str) -> List[Dict[str, Any]]:
-    logger.info("Using manual similarity calculation for document retrieval")
+    logger.info("Using the in-memory embedding index for document retrieval")
     
     try:
-        batch_size = 150  
-        max_docs = 1500   
-        all_scored = []
-        processed_count = 0
-        
-        query_words = set(query.lower().split())
-        filter_query = {"embedding": {"$exists": True}}
-        
-        voting_keywords = ["vote", "voting", "ballot", "election", "poll"]
-        id_keywords = ["id", "identification", "proof", "document", "license"]
-        
-        if any(word in query.lower() for word in voting_keywords):
-            cursor1 = collection.find(
-                {"embedding": {"$exists": True}, "text": {"$regex": "vote|voting|ballot|poll", "$options": "i"}},
-                {"id": 1, "source": 1, "text": 1, "chunk_index": 1, "total_chunks": 1, "embedding": 1}
-            ).limit(max_docs // 2).batch_size(batch_size)
-            
-            cursor2 = collection.find(
-                {"embedding": {"$exists": True}, "text": {"$not": {"$regex": "vote|voting|ballot|poll", "$options": "i"}}},
-                {"id": 1, "source": 1, "text": 1, "chunk_index": 1, "total_chunks": 1, "embedding": 1}
-            ).limit(max_docs // 2).batch_size(batch_size)
-            
-            all_cursors = [cursor1, cursor2]
-        elif any(word in query.lower() for word in id_keywords):
-            cursor1 = collection.find(
-                {"embedding": {"$exists": True}, "text": {"$regex": "id|identification|proof|document|license", "$options": "i"}},
-                {"id": 1, "source": 1, "text": 1, "chunk_index": 1, "total_chunks": 1, "embedding": 1}
-            ).limit(max_docs // 2).batch_size(batch_size)
-            
-            cursor2 = collection.find(
-                {"embedding": {"$exists": True}, "text": {"$not": {"$regex": "id|identification|proof|document|license", "$options": "i"}}},
-                {"id": 1, "source": 1, "text": 1, "chunk_index": 1, "total_chunks": 1, "embedding": 1}
-            ).limit(max_docs // 2).batch_size(batch_size)
-            
-            all_cursors = [cursor1, cursor2]
-        else:
-            all_cursors = [collection.find(
-                filter_query,
-                {"id": 1, "source": 1, "text": 1, "chunk_index": 1, "total_chunks": 1, "embedding": 1}
-            ).limit(max_docs).batch_size(batch_size)]
-        
-        docs_batch = []
-        for cursor in all_cursors:
-            try:
-                for doc in cursor:
-                    docs_batch.append(doc)
-                    
-                    if len(docs_batch) >= batch_size:
-                        try:
-                            batch_scores = _process_document_batch(docs_batch, q_emb)
-                            all_scored.extend(batch_scores)
-                            processed_count += len(docs_batch)
-                            
-                            if len(all_scored) > k * 10:
-                                all_scored.sort(key=lambda x: x["score"], reverse=True)
-                                all_scored = all_scored[:k * 5]  
-                            
-                            docs_batch = []
-                            
-                            if processed_count % 500 == 0:
-                                logger.info(f"Processed {processed_count} documents...")
-                                
-                        except Exception as e:
-                            logger.warning(f"Error processing batch: {e}")
-                            docs_batch = []  
-                            continue
-                            
-                    if processed_count >= max_docs:
-                        break
-                        
-            except Exception as cursor_error:
-                logger.warning(f"Cursor error: {cursor_error}")
-                continue
-            
-            if processed_count >= max_docs:
-                break
-        
-        if docs_batch:
-            try:
-                batch_scores = _process_document_batch(docs_batch, q_emb)
-                all_scored.extend(batch_scores)
-                processed_count += len(docs_batch)
-            except Exception as e:
-                logger.warning(f"Error processing final batch: {e}")
-        
-        if not all_scored:
-            logger.warning("No documents processed successfully")
-            return []
-        
-        all_scored.sort(key=lambda x: x["score"], reverse=True)
-        results = all_scored[:k]
-        
-        logger.info(f"Manual search processed {processed_count} documents, returned {len(results)} results")
+        start = time.time()
+        index = _index_holder.get()
+        results = index.search(q_emb, k)
+        logger.info(f"Index search over {len(index)} chunks took {(time.time() - start) * 1000:.2f}ms, returned {len(results)} results")
         return results
         
     except Exception as e:
@@ -342,27 +226,6 @@ def _manual_similarity_search(q_emb: List[float], k: int, query: str) -> List[Di
         return []
 
 
-def _process_document_batch(batch: List[Dict], q_emb: List[float]) -> List[Dict[str, Any]]:
-    scored = []
-    
-    for doc in batch:
-        emb = doc.get("embedding")
-        if not emb or len(emb) != len(q_emb):
-            continue
-        
-        score = cosine_similarity(q_emb, emb)
-        scored.append({
-            "id": doc["id"],
-            "source": doc["source"],
-            "text": doc["text"],
-            "chunk_index": doc.get("chunk_index"),
-            "total_chunks": doc.get("total_chunks"),
-            "score": score
-        })
-    
-    return scored
-
-
 def build_context(chunks: List[Dict[str, Any]]) -> str:
     parts = []
     for c in chunks:
@@ -375,6 +238,13 @@ def ask_rag(query: str, k: int = 3) -> Dict[str, Any]:
     if not query or not query.strip():
         raise ValueError("Query cannot be empty")
     
+    cache_key = _get_query_cache_key(query, k)
+    cached_answer = _answer_cache.get(cache_key)
+    if cached_answer is not None:
+        logger.info("Returning cached answer")
+        # Callers add request details to the response; keep the cached entry untouched.
+        return dict(cached_answer)
+
     try:
         logger.info(f"Processing RAG query: {query[:100]}...")
         retrieved = retrieve_top_k(query, k=k)
@@ -432,12 +302,14 @@ def ask_rag(query: str, k: int = 3) -> Dict[str, Any]:
             answer = resp.choices[0].message.content
             logger.info("Successfully generated response")
 
-            return {
+            result = {
                 "answer": answer,
                 "retrieved": retrieved,
                 "status": "success",
                 "context_length": len(context)
             }
+            _answer_cache.set(cache_key, result)
+            return dict(result)
             
         except OpenAIError as e:
             logger.error(f"OpenAI API error: {e}")
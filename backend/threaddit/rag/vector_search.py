@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = "available"
+UNAVAILABLE = "unavailable"
+OPEN = "open"
+
+
+class VectorSearchCircuit:
+    # Whether queries should use Mongo's $vectorSearch, kept as retriever state instead of
+    # being probed on every request. A probe at startup sets the capability; after
+    # failure_threshold consecutive query failures the circuit opens and queries use the
+    # local index. A background probe runs at most every probe_interval seconds in every
+    # state: it closes the circuit once $vectorSearch answers again, and notices an index
+    # that was dropped or changed dimension even while queries rarely use it.
+
+    def __init__(
+        self,
+        collection,
+        index_name: str = "vector_index",
+        path: str = "embedding",
+        failure_threshold: int = 3,
+        probe_interval: float = 60,
+    ):
+        self.collection = collection
+        self.index_name = index_name
+        self.path = path
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = UNAVAILABLE
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.last_probe_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+
+    def pipeline(self, q_emb: List[float], k: int) -> List[Dict[str, Any]]:
+        return [
+            {
+                "$vectorSearch": {
+                    "index": self.index_name,
+                    "path": self.path,
+                    "queryVector": q_emb,
+                    "numCandidates": min(k * 10, 1000),
+                    "limit": k
+                }
+            },
+            {
+                "$project": {
+                    "id": 1,
+                    "source": 1,
+                    "text": 1,
+                    "chunk_index": 1,
+                    "total_chunks": 1,
+                    "score": {"$meta": "vectorSearchScore"}
+                }
+            }
+        ]
+
+    def probe(self) -> bool:
+        # Runs a one-result search with a stored embedding, so it checks the real index and
+        # dimension rather than only whether the stage parses.
+        self.last_probe_at = time.time()
+        try:
+            sample = self.collection.find_one({self.path: {"$exists": True}}, {self.path: 1, "_id": 0})
+            if not sample:
+                raise RuntimeError("no embedded documents to probe with")
+            list(self.collection.aggregate(self.pipeline(sample[self.path], 1)))
+        except Exception as e:
+            with self._lock:
+                self.last_error = str(e)
+                if self.state == AVAILABLE:
+                    self.state = UNAVAILABLE
+            logger.info(f"$vectorSearch probe failed ({self.state}): {e}")
+            return False
+        with self._lock:
+            if self.state != AVAILABLE:
+                logger.info("$vectorSearch available")
+            self.state = AVAILABLE
+            self.consecutive_failures = 0
+            self.last_error = None
+        return True
+
+    def available(self) -> bool:
+        if time.time() - (self.last_probe_at or 0) >= self.probe_interval and self._probe_lock.acquire(blocking=False):
+            threading.Thread(target=self._background_probe, name="vector-search-probe", daemon=True).start()
+        return self.state == AVAILABLE
+
+    def record_success(self) -> None:
+        if self.consecutive_failures:
+            with self._lock:
+                self.consecutive_failures = 0
+
+    def record_failure(self, error: Exception) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            if self.state == AVAILABLE and self.consecutive_failures >= self.failure_threshold:
+                self.state = OPEN
+                # Wait a full interval before the first recovery probe.
+                self.last_probe_at = time.time()
+                logger.warning(
+                    f"$vectorSearch failed {self.consecutive_failures} times in a row, "
+                    f"using the local index until a probe succeeds: {error}"
+                )
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_probe_at": self.last_probe_at,
+            "last_error": self.last_error,
+        }
+
+    def _background_probe(self) -> None:
+        try:
+            self.probe()
+        finally:
+            self._probe_lock.release()
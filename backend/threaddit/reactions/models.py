@@ -1,4 +1,7 @@
+from sqlalchemy import delete, text, update
+from sqlalchemy.dialects.postgresql import insert
 from threaddit import db
+from threaddit.cache import invalidate_on_commit
 
 class Reactions(db.Model):
     __tablename__ = "reactions"
@@ -11,6 +14,10 @@ class Reactions(db.Model):
     user = db.relationship("User", back_populates="reaction")
     comment = db.relationship("Comments", back_populates="reaction")
     post = db.relationship("Posts", back_populates="reaction")
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "post_id", name="reactions_user_id_post_id_key"),
+        db.UniqueConstraint("user_id", "comment_id", name="reactions_user_id_comment_id_key"),
+    )
 
     def __init__(self, user_id, is_upvote, post_id=None, comment_id=None):
         self.user_id = user_id
@@ -19,14 +26,85 @@ class Reactions(db.Model):
         self.is_upvote = is_upvote
 
     @classmethod
-    def add(cls, user_id, is_upvote, post_id=None, comment_id=None):
-        new_reaction = Reactions(user_id=user_id, is_upvote=is_upvote, post_id=post_id, comment_id=comment_id)
-        db.session.add(new_reaction)
+    def _upsert_statement(cls, rows, target):
+        # One statement whatever the current state, so concurrent votes from the same
+        # user cannot race into a duplicate; an unchanged vote writes nothing.
+        statement = insert(cls).values(rows)
+        return statement.on_conflict_do_update(
+            index_elements=["user_id", target],
+            set_={"is_upvote": statement.excluded.is_upvote},
+            where=cls.is_upvote.is_distinct_from(statement.excluded.is_upvote),
+        )
+
+    @classmethod
+    def upsert(cls, user_id, is_upvote, post_id=None, comment_id=None):
+        target = "post_id" if post_id is not None else "comment_id"
+        row = {"user_id": user_id, "is_upvote": is_upvote, "post_id": post_id, "comment_id": comment_id}
+        db.session.execute(cls._upsert_statement([row], target))
         db.session.commit()
 
-    def patch(self, is_upvote):
-        self.is_upvote = is_upvote
+    @classmethod
+    def apply_batch(cls, user_id, votes):
+        """Apply ``{(target, target_id): is_upvote}`` for one user in a single transaction.
+
+        ``target`` is ``"post_id"`` or ``"comment_id"`` and ``is_upvote=None`` removes
+        the vote. Each target kind costs one multi-row upsert and one delete. Returns
+        the resulting vote for every target, in the order given.
+        """
+        for target in ("post_id", "comment_id"):
+            # Sorted, so two batches of the same user lock their rows in the same order.
+            target_votes = sorted(
+                (target_id, is_upvote) for (kind, target_id), is_upvote in votes.items() if kind == target
+            )
+            upserts = [
+                {"user_id": user_id, target: target_id, "is_upvote": is_upvote}
+                for target_id, is_upvote in target_votes
+                if is_upvote is not None
+            ]
+            removals = [target_id for target_id, is_upvote in target_votes if is_upvote is None]
+            if upserts:
+                db.session.execute(cls._upsert_statement(upserts, target))
+            if removals:
+                db.session.execute(delete(cls).where(cls.user_id == user_id, getattr(cls, target).in_(removals)))
+        db.session.commit()
+
+        states = {}
+        for target in ("post_id", "comment_id"):
+            target_ids = [target_id for kind, target_id in votes if kind == target]
+            if target_ids:
+                column = getattr(cls, target)
+                rows = db.session.query(column, cls.is_upvote).filter(cls.user_id == user_id, column.in_(target_ids))
+                states.update(((target, target_id), is_upvote) for target_id, is_upvote in rows)
+        return [{kind: target_id, "is_upvote": states.get((kind, target_id))} for kind, target_id in votes]
+
+    @classmethod
+    def _target(cls, post_id, comment_id):
+        return cls.post_id == post_id if post_id is not None else cls.comment_id == comment_id
+
+    @classmethod
+    def update_vote(cls, user_id, is_upvote, post_id=None, comment_id=None):
+        # Returns False when the user has no reaction on the target.
+        result = db.session.execute(
+            update(cls)
+            .where(cls.user_id == user_id, cls._target(post_id, comment_id))
+            .values(is_upvote=is_upvote)
+            .returning(cls.id)
+        )
+        updated = result.first() is not None
         db.session.commit()
+        return updated
+
+    @classmethod
+    def remove(cls, user_id, post_id=None, comment_id=None):
+        # Returns False when the user has no reaction on the target.
+        result = db.session.execute(
+            delete(cls)
+            .where(cls.user_id == user_id, cls._target(post_id, comment_id))
+            .returning(cls.id)
+        )
+        removed = result.first() is not None
+        db.session.commit()
+        return removed
 
     def as_dict(self):
         return {
@@ -37,3 +115,82 @@ class Reactions(db.Model):
             "is_upvote": self.is_upvote,
             "created_at": self.created_at,
         }
+
+
+class KarmaJournal(db.Model):
+    # Vote deltas appended by the karma_journal_* trigger in schema.sql.
+    __tablename__ = "karma_journal"
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
+    comment_id = db.Column(db.Integer, db.ForeignKey("comments.id"))
+    delta = db.Column(db.Integer, nullable=False)
+
+    @classmethod
+    def flush(cls, batch_size=5000):
+        # Fold pending deltas into post_stats and user_stats, one net update per post and
+        # per author for each batch; returns how many journal rows were applied. Every
+        # vote change also counts as engagement in post_stats.activity.
+        # Rows claimed by a concurrent flusher are skipped. Cached pages only show karma
+        # from post_stats, so this is where votes reach them: the communities of the
+        # updated posts are invalidated with each batch (across processes, this needs
+        # the shared CACHE_REDIS_URL backend).
+        total = 0
+        while True:
+            applied, subthread_ids = db.session.execute(
+                text(
+                    """
+                    WITH batch AS (
+                        DELETE FROM karma_journal
+                        WHERE id IN (
+                            SELECT id FROM karma_journal
+                            ORDER BY id
+                            LIMIT :batch_size
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING post_id, comment_id, delta
+                    ), post_deltas AS (
+                        SELECT post_id, SUM(delta) AS delta, COUNT(*) AS votes
+                        FROM batch
+                        WHERE post_id IS NOT NULL
+                        GROUP BY post_id
+                    ), posts_applied AS (
+                        UPDATE post_stats s
+                        SET karma = s.karma + d.delta,
+                            activity = post_activity_add(s.activity, CURRENT_TIMESTAMP, d.votes::INTEGER),
+                            needs_rescore = TRUE
+                        FROM post_deltas d
+                        WHERE s.post_id = d.post_id
+                    ), author_deltas AS (
+                        SELECT p.user_id, d.delta AS posts_delta, 0 AS comments_delta
+                        FROM post_deltas d JOIN posts p ON p.id = d.post_id
+                        WHERE d.delta <> 0
+                        UNION ALL
+                        SELECT c.user_id, 0, b.delta
+                        FROM batch b JOIN comments c ON c.id = b.comment_id
+                    ), authors_applied AS (
+                        UPDATE user_stats s
+                        SET posts_karma = s.posts_karma + a.posts_delta,
+                            comments_karma = s.comments_karma + a.comments_delta
+                        FROM (
+                            SELECT user_id, SUM(posts_delta) AS posts_delta, SUM(comments_delta) AS comments_delta
+                            FROM author_deltas
+                            GROUP BY user_id
+                        ) a
+                        WHERE s.user_id = a.user_id AND (a.posts_delta <> 0 OR a.comments_delta <> 0)
+                    )
+                    SELECT
+                        (SELECT COUNT(*) FROM batch) AS applied,
+                        ARRAY(
+                            SELECT DISTINCT p.subthread_id
+                            FROM post_deltas d JOIN posts p ON p.id = d.post_id
+                            WHERE p.subthread_id IS NOT NULL
+                        ) AS subthread_ids
+                    """
+                ),
+                {"batch_size": batch_size},
+            ).one()
+            invalidate_on_commit(*(f"subthread:{subthread_id}" for subthread_id in subthread_ids))
+            db.session.commit()
+            total += applied
+            if applied < batch_size:
+                return total
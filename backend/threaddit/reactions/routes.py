@@ -1,9 +1,14 @@
+import time
+import click
 from flask import Blueprint, jsonify, request
 from threaddit import db
-from threaddit.reactions.models import Reactions
+from threaddit.cache import LocalCacheBackend, response_cache
+from threaddit.reactions.models import KarmaJournal, Reactions
 from flask_login import current_user, login_required
+from sqlalchemy.exc import IntegrityError
 
 reactions = Blueprint("reactions", __name__, url_prefix="/api")
+MAX_BATCH_REACTIONS = 200
 
 
 @reactions.route("/reactions/post/<post_id>", methods=["PATCH"])
@@ -13,16 +18,12 @@ def update_reaction_post(post_id):
         if not request.json:
             return jsonify({"message": "Invalid Request"}), 400
         
-        update_reaction = Reactions.query.filter_by(post_id=post_id, user_id=current_user.id).first()
-        if not update_reaction:
-            return jsonify({"message": "Reaction not found"}), 404
-        
         is_upvote = request.json.get("is_upvote")
         if is_upvote is None:
             return jsonify({"message": "is_upvote is required"}), 400
         
-        update_reaction.is_upvote = bool(is_upvote)
-        db.session.commit()
+        if not Reactions.update_vote(current_user.id, bool(is_upvote), post_id=post_id):
+            return jsonify({"message": "Reaction not found"}), 404
         
         print(f"[Reactions] Updated reaction for post {post_id} by user {current_user.id}: is_upvote={is_upvote}")
         return jsonify({"message": "Reaction updated"}), 200
@@ -45,12 +46,8 @@ def add_reaction_post(post_id):
         if is_upvote is None:
             return jsonify({"message": "is_upvote is required"}), 400
         
-        # Check if reaction already exists
-        existing_reaction = Reactions.query.filter_by(post_id=post_id, user_id=current_user.id).first()
-        if existing_reaction:
-            return jsonify({"message": "Reaction already exists. Use PATCH to update."}), 409
-        
-        Reactions.add(user_id=current_user.id, is_upvote=bool(is_upvote), post_id=post_id)
+        # Upsert: a repeated or concurrent PUT just sets the vote
+        Reactions.upsert(user_id=current_user.id, is_upvote=bool(is_upvote), post_id=post_id)
         
         print(f"[Reactions] Added reaction for post {post_id} by user {current_user.id}: is_upvote={is_upvote}")
         return jsonify({"message": "Reaction added"}), 200
@@ -66,13 +63,9 @@ def add_reaction_post(post_id):
 @login_required
 def delete_reaction_post(post_id):
     try:
-        reaction = Reactions.query.filter_by(post_id=post_id, user_id=current_user.id).first()
-        if not reaction:
+        if not Reactions.remove(current_user.id, post_id=post_id):
             return jsonify({"message": "Reaction not found"}), 404
         
-        Reactions.query.filter_by(post_id=post_id, user_id=current_user.id).delete()
-        db.session.commit()
-        
         print(f"[Reactions] Deleted reaction for post {post_id} by user {current_user.id}")
         return jsonify({"message": "Reaction deleted"}), 200
     except Exception as e:
@@ -94,12 +87,9 @@ def update_reaction_comment(comment_id):
         if is_upvote is None:
             return jsonify({"message": "is_upvote is required"}), 400
         
-        reaction = Reactions.query.filter_by(comment_id=comment_id, user_id=current_user.id).first()
-        if not reaction:
+        if not Reactions.update_vote(current_user.id, bool(is_upvote), comment_id=comment_id):
             return jsonify({"message": "Reaction not found"}), 404
         
-        reaction.patch(bool(is_upvote))
-        
         print(f"[Reactions] Updated reaction for comment {comment_id} by user {current_user.id}: is_upvote={is_upvote}")
         return jsonify({"message": "Reaction updated"}), 200
     except Exception as e:
@@ -121,12 +111,8 @@ def add_reaction_comment(comment_id):
         if is_upvote is None:
             return jsonify({"message": "is_upvote is required"}), 400
         
-        # Check if reaction already exists
-        existing_reaction = Reactions.query.filter_by(comment_id=comment_id, user_id=current_user.id).first()
-        if existing_reaction:
-            return jsonify({"message": "Reaction already exists. Use PATCH to update."}), 409
-        
-        Reactions.add(user_id=current_user.id, is_upvote=bool(is_upvote), comment_id=comment_id)
+        # Upsert: a repeated or concurrent PUT just sets the vote
+        Reactions.upsert(user_id=current_user.id, is_upvote=bool(is_upvote), comment_id=comment_id)
         
         print(f"[Reactions] Added reaction for comment {comment_id} by user {current_user.id}: is_upvote={is_upvote}")
         return jsonify({"message": "Reaction added"}), 200
@@ -142,13 +128,9 @@ def add_reaction_comment(comment_id):
 @login_required
 def delete_reaction_comment(comment_id):
     try:
-        reaction = Reactions.query.filter_by(comment_id=comment_id, user_id=current_user.id).first()
-        if not reaction:
+        if not Reactions.remove(current_user.id, comment_id=comment_id):
             return jsonify({"message": "Reaction not found"}), 404
         
-        Reactions.query.filter_by(comment_id=comment_id, user_id=current_user.id).delete()
-        db.session.commit()
-        
         print(f"[Reactions] Deleted reaction for comment {comment_id} by user {current_user.id}")
         return jsonify({"message": "Reaction deleted"}), 200
     except Exception as e:
@@ -157,3 +139,71 @@ def delete_reaction_comment(comment_id):
         print(traceback.format_exc())
         db.session.rollback()
         return jsonify({"message": f"Error deleting reaction: {str(e)}"}), 500
+
+
+def _batch_target(operation):
+    # ("post_id" | "comment_id", id) for a well-formed batch operation, else None.
+    if not isinstance(operation, dict):
+        return None
+    targets = [key for key in ("post_id", "comment_id") if operation.get(key) is not None]
+    if len(targets) != 1:
+        return None
+    target_id = operation[targets[0]]
+    if not isinstance(target_id, int) or isinstance(target_id, bool):
+        return None
+    return targets[0], target_id
+
+
+@reactions.route("/reactions/batch", methods=["POST"])
+@login_required
+def batch_reactions():
+    # Body: [{"post_id" | "comment_id": id, "is_upvote": true | false | null}, ...];
+    # null removes the vote and a later operation on the same target wins.
+    operations = request.get_json(silent=True)
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"message": "Expected a non-empty list of reactions"}), 400
+    if len(operations) > MAX_BATCH_REACTIONS:
+        return jsonify({"message": f"At most {MAX_BATCH_REACTIONS} reactions per batch"}), 400
+
+    votes = {}
+    for operation in operations:
+        target = _batch_target(operation)
+        # is_upvote must be present; only an explicit null removes the vote.
+        if target is None or "is_upvote" not in operation or not isinstance(operation["is_upvote"], (bool, type(None))):
+            return jsonify({"message": "Each reaction needs one post_id or comment_id and is_upvote true, false or null"}), 400
+        # Re-insert so the result order follows the last operation on each target.
+        votes.pop(target, None)
+        votes[target] = operation["is_upvote"]
+
+    try:
+        results = Reactions.apply_batch(current_user.id, votes)
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "Post or comment not found"}), 404
+    except Exception as e:
+        import traceback
+        print(f"[Reactions] Error applying reaction batch: {str(e)}")
+        print(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"message": f"Error applying reactions: {str(e)}"}), 500
+
+    print(f"[Reactions] Applied {len(votes)} reactions by user {current_user.id}")
+    return jsonify({"reactions": results}), 200
+
+
+@reactions.cli.command("flush-karma")
+@click.option("--interval", default=0, type=float, help="Seconds between passes; 0 runs a single pass.")
+@click.option("--batch-size", default=5000, type=int)
+def flush_karma(interval, batch_size):
+    if isinstance(response_cache.backend, LocalCacheBackend):
+        click.echo(
+            "[Reactions] CACHE_REDIS_URL is not set; the web workers' cached pages will only pick up "
+            "karma changes when their entries expire",
+            err=True,
+        )
+    while True:
+        flushed = KarmaJournal.flush(batch_size=batch_size)
+        click.echo(f"[Reactions] Applied {flushed} karma deltas")
+        if interval <= 0:
+            return
+        time.sleep(interval)
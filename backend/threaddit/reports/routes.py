@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify
+from threaddit.conditional import conditional_json
 from flask_login import login_required, current_user
 from threaddit import db
 from threaddit.reports.models import Report
@@ -84,13 +85,13 @@ def get_reports():
         report_schema = ReportSchema(many=True)
         reports_data = report_schema.dump(paginated_reports.items)
         
-        return jsonify({
+        return conditional_json({
             "reports": reports_data,
             "total": paginated_reports.total,
             "page": page,
             "per_page": per_page,
             "pages": paginated_reports.pages
-        }), 200
+        })
         
     except Exception as e:
         return jsonify({"message": f"Error fetching reports: {str(e)}"}), 500
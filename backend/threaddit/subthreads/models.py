@@ -4,8 +4,12 @@ import uuid
 from datetime import datetime
 from flask_marshmallow.fields import fields
 from marshmallow.exceptions import ValidationError
-from sqlalchemy import func
+from sqlalchemy import delete, func, text
+from sqlalchemy.dialects.postgresql import insert
 import re
+from threaddit.cache import invalidate_on_commit
+from threaddit.models import Role, UserRole
+from threaddit.users.models import User
 
 
 class Subthread(db.Model):
@@ -92,7 +96,11 @@ class Subthread(db.Model):
             res = uploader.destroy(self.banner_url.split("/")[-1])
             print(f"Cloudinary Banner Destroy Response for {self.name}: ", res)
 
-    def as_dict(self, cur_user_id=None, include_full=False):
+    def as_dict(self, cur_user_id=None, include_full=False, bulk_state=None):
+        if bulk_state is None:
+            bulk_state = Subthread.get_bulk_state([self], cur_user_id)
+        stats = bulk_state["stats"].get(self.id)
+        creator = bulk_state["creators"].get(self.created_by)
         data = {
             "id": self.id,
             "name": self.name,
@@ -103,23 +111,62 @@ class Subthread(db.Model):
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
             "logo": self.logo,
             "banner_url": self.banner_url,
-            "PostsCount": len(self.post),
-            "CommentsCount": sum([len(p.comment) for p in self.post]),
-            "created_by": self.user.username if self.user else None,
-            "subscriberCount": len(self.subscription),
-            "modList": [r.user.username for r in self.user_role if r.role.slug == "mod"],
+            "PostsCount": stats.posts_count if stats else 0,
+            "CommentsCount": stats.comments_count if stats else 0,
+            "created_by": creator.username if creator else None,
+            "subscriberCount": stats.members_count if stats else 0,
+            "modList": bulk_state["mods"].get(self.id, []),
         }
-        if include_full and self.user:
+        if include_full and creator:
             data["creator_info"] = {
-                "username": self.user.username,
-                "avatar": self.user.avatar,
+                "username": creator.username,
+                "avatar": creator.avatar,
             }
         if cur_user_id:
-            data["has_subscribed"] = bool(
-                Subscription.query.filter_by(user_id=cur_user_id, subthread_id=self.id).first()
-            )
+            data["has_subscribed"] = self.id in bulk_state["subscribed"]
         return data
 
+    @classmethod
+    def bulk_as_dict(cls, subthreads, cur_user_id=None, include_full=False):
+        bulk_state = cls.get_bulk_state(subthreads, cur_user_id)
+        return [s.as_dict(cur_user_id, include_full, bulk_state) for s in subthreads]
+
+    @staticmethod
+    def get_bulk_state(subthreads, cur_user_id=None):
+        # Counters, creators, mods and the viewer's subscriptions for a batch of
+        # subthreads in four queries, independent of how many posts/comments they hold.
+        subthread_ids = [s.id for s in subthreads]
+        creator_ids = {s.created_by for s in subthreads if s.created_by}
+        bulk_state = {"stats": {}, "creators": {}, "mods": {}, "subscribed": set()}
+        if not subthread_ids:
+            return bulk_state
+        bulk_state["stats"] = {
+            stats.subthread_id: stats
+            for stats in SubthreadStats.query.filter(SubthreadStats.subthread_id.in_(subthread_ids))
+        }
+        if creator_ids:
+            bulk_state["creators"] = {
+                row.id: row
+                for row in db.session.query(User.id, User.username, User.avatar).filter(User.id.in_(creator_ids))
+            }
+        mods = (
+            db.session.query(UserRole.subthread_id, User.username)
+            .join(User, User.id == UserRole.user_id)
+            .join(Role, Role.id == UserRole.role_id)
+            .filter(Role.slug == "mod", UserRole.subthread_id.in_(subthread_ids))
+            .order_by(UserRole.id)
+        )
+        for subthread_id, username in mods:
+            bulk_state["mods"].setdefault(subthread_id, []).append(username)
+        if cur_user_id:
+            bulk_state["subscribed"] = {
+                row.subthread_id
+                for row in db.session.query(Subscription.subthread_id).filter(
+                    Subscription.user_id == cur_user_id, Subscription.subthread_id.in_(subthread_ids)
+                )
+            }
+        return bulk_state
+
     def as_dict_minimal(self):
         return {
             "id": self.id,
@@ -141,18 +188,70 @@ class Subscription(db.Model):
     subthread_id = db.Column(db.Integer, db.ForeignKey("subthreads.id"), nullable=False)
     user = db.relationship("User", back_populates="subscription")
     subthread = db.relationship("Subthread", back_populates="subscription")
+    __table_args__ = (db.UniqueConstraint("user_id", "subthread_id", name="subscriptions_user_id_subthread_id_key"),)
 
     @classmethod
     def add(cls, thread_id, user_id):
-        new_sub = Subscription(user_id=user_id, subthread_id=thread_id)
-        db.session.add(new_sub)
+        # Subscribing twice keeps the single existing row, so members_count is not inflated.
+        db.session.execute(
+            insert(cls)
+            .values(user_id=user_id, subthread_id=thread_id)
+            .on_conflict_do_nothing(index_elements=["user_id", "subthread_id"])
+        )
+        invalidate_on_commit(f"subthread:{thread_id}", "subthreads")
         db.session.commit()
 
+    @classmethod
+    def remove(cls, thread_id, user_id):
+        # Returns False when the user was not subscribed.
+        result = db.session.execute(
+            delete(cls).where(cls.user_id == user_id, cls.subthread_id == thread_id).returning(cls.id)
+        )
+        removed = result.first() is not None
+        if removed:
+            invalidate_on_commit(f"subthread:{thread_id}", "subthreads")
+        db.session.commit()
+        return removed
+
     def __init__(self, user_id, subthread_id):
         self.user_id = user_id
         self.subthread_id = subthread_id
 
 
+class SubthreadStats(db.Model):
+    # Counters are maintained by the subthread_stats_* triggers in schema.sql.
+    __tablename__ = "subthread_stats"
+    subthread_id = db.Column(db.Integer, db.ForeignKey("subthreads.id"), primary_key=True)
+    members_count = db.Column(db.Integer, nullable=False, default=0)
+    posts_count = db.Column(db.Integer, nullable=False, default=0)
+    comments_count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def reconcile(cls):
+        # Recount every subthread and rewrite only the rows that drifted; returns how many were fixed.
+        result = db.session.execute(
+            text(
+                """
+                INSERT INTO subthread_stats (subthread_id, members_count, posts_count, comments_count)
+                SELECT
+                    s.id,
+                    (SELECT COUNT(*) FROM subscriptions m WHERE m.subthread_id = s.id),
+                    (SELECT COUNT(*) FROM posts p WHERE p.subthread_id = s.id),
+                    (SELECT COUNT(*) FROM comments c JOIN posts p ON p.id = c.post_id WHERE p.subthread_id = s.id)
+                FROM subthreads s
+                ON CONFLICT (subthread_id) DO UPDATE
+                SET members_count = EXCLUDED.members_count,
+                    posts_count = EXCLUDED.posts_count,
+                    comments_count = EXCLUDED.comments_count
+                WHERE (subthread_stats.members_count, subthread_stats.posts_count, subthread_stats.comments_count)
+                    IS DISTINCT FROM (EXCLUDED.members_count, EXCLUDED.posts_count, EXCLUDED.comments_count)
+                """
+            )
+        )
+        db.session.commit()
+        return result.rowcount
+
+
 class SubthreadInfo(db.Model):
     __tablename__ = "subthread_info"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -1,10 +1,19 @@
-from threaddit.subthreads.models import Subthread, SubthreadInfo, Subscription, SubthreadCreateValidator
+from threaddit.subthreads.models import (
+    Subthread,
+    SubthreadInfo,
+    SubthreadStats,
+    Subscription,
+    SubthreadCreateValidator,
+)
+import click
 from flask_login import current_user, login_required
 import re
 from threaddit.users.models import User
 from flask import Blueprint, jsonify, request
 from threaddit.models import UserRole
 from threaddit import db
+from threaddit.cache import cache_tags, invalidate_on_commit, response_cache
+from threaddit.conditional import conditional_json
 from threaddit.auth.decorators import auth_role
 from threaddit.posts.models import PostInfo
 from marshmallow import ValidationError as MarshmallowValidationError
@@ -14,19 +23,25 @@ thread_name_regex = re.compile(r"^\w{3,}$")
 
 
 @threads.route("/threads", methods=["GET"])
+@response_cache.cached(ttl=60, tags=["subthreads"])
 def get_subthreads():
     limit = request.args.get("limit", default=10, type=int)
     offset = request.args.get("offset", default=0, type=int)
     cur_user = current_user.id if current_user.is_authenticated else None
     subscribed_threads = []
     if current_user.is_authenticated:
-        subscribed_threads = [
-            subscription.subthread.as_dict(cur_user)
-            for subscription in Subscription.query.filter_by(user_id=current_user.id).limit(limit).offset(offset).all()
-        ]
+        subscribed_threads = Subthread.bulk_as_dict(
+            Subthread.query.join(Subscription, Subscription.subthread_id == Subthread.id)
+            .filter(Subscription.user_id == current_user.id)
+            .order_by(Subscription.id)
+            .limit(limit)
+            .offset(offset)
+            .all(),
+            cur_user,
+        )
     all_threads = [
         subinfo.as_dict()
-        for subinfo in SubthreadInfo.query.filter(SubthreadInfo.members_count.is_not(None))
+        for subinfo in SubthreadInfo.query.filter(SubthreadInfo.members_count > 0)
         .order_by(SubthreadInfo.members_count.desc())
         .limit(limit)
         .offset(offset)
@@ -34,7 +49,7 @@ def get_subthreads():
     ]
     popular_threads = [
         subinfo.as_dict()
-        for subinfo in SubthreadInfo.query.filter(SubthreadInfo.posts_count.is_not(None))
+        for subinfo in SubthreadInfo.query.filter(SubthreadInfo.posts_count > 0)
         .order_by(SubthreadInfo.posts_count.desc())
         .limit(limit)
         .offset(offset)
@@ -63,9 +78,10 @@ def subthread_search():
 
 
 @threads.route("/threads/get/all")
+@response_cache.cached(ttl=60, tags=["subthreads"])
 def get_all_thread():
     threads = Subthread.query.order_by(Subthread.name).all()
-    return jsonify([t.as_dict() for t in threads]), 200
+    return jsonify(Subthread.bulk_as_dict(threads)), 200
 
 
 @threads.route("/subthread/all", methods=["GET"])
@@ -75,6 +91,7 @@ def get_all_subthreads():
 
 
 @threads.route("/subthread/<name>", methods=["GET"])
+@response_cache.cached(ttl=30)
 def get_subthread_by_name(name):
     if not name.startswith("t/"):
         name = f"t/{name.lower()}"
@@ -84,16 +101,17 @@ def get_subthread_by_name(name):
     subthread = Subthread.query.filter_by(name=name).first()
     if not subthread:
         return jsonify({"message": "Community not found"}), 404
+    cache_tags(f"subthread:{subthread.id}")
     
     cur_user_id = current_user.id if current_user.is_authenticated else None
     
     posts = PostInfo.query.filter_by(thread_id=subthread.id).order_by(PostInfo.created_at.desc()).limit(20).all()
-    posts_data = [p.as_dict(cur_user_id) for p in posts]
+    posts_data = PostInfo.bulk_as_dict(posts, cur_user_id)
     
-    return jsonify({
+    return conditional_json({
         "subthread": subthread.as_dict(cur_user_id=cur_user_id, include_full=True),
         "posts": posts_data,
-    }), 200
+    })
 
 
 @threads.route("/threads/<thread_name>")
@@ -102,14 +120,11 @@ def get_thread_by_name(thread_name):
     subthread = Subthread.query.filter_by(name=f"t/{thread_name}").first()
     if not thread_info and subthread:
         return jsonify({"message": "Thread not found"}), 404
-    return (
-        jsonify(
-            {
-                "threadData": thread_info.as_dict()
-                | subthread.as_dict(current_user.id if current_user.is_authenticated else None)
-            }
-        ),
-        200,
+    return conditional_json(
+        {
+            "threadData": thread_info.as_dict()
+            | subthread.as_dict(current_user.id if current_user.is_authenticated else None)
+        }
     )
 
 
@@ -123,11 +138,7 @@ def new_subscription(tid):
 @threads.route("threads/subscription/<tid>", methods=["DELETE"])
 @login_required
 def del_subscription(tid):
-    subscription = Subscription.query.filter_by(user_id=current_user.id, subthread_id=tid).first()
-    if subscription:
-        Subscription.query.filter_by(user_id=current_user.id, subthread_id=tid).delete()
-        db.session.commit()
-    else:
+    if not Subscription.remove(tid, current_user.id):
         return jsonify({"message": "Invalid Subscription"}), 400
     return jsonify({"message": "UnSubscribed"}), 200
 
@@ -281,6 +292,14 @@ def delete_mod(tid, username):
         if thread.created_by == user.id and not current_user.has_role("admin"):
             return jsonify({"message": "Cannot Remove Thread Creator"}), 400
         UserRole.query.filter_by(user_id=user.id, subthread_id=tid).delete()
+        # Bulk deletes skip the session's flush hooks, so drop the cached page here.
+        invalidate_on_commit(f"subthread:{thread.id}")
         db.session.commit()
         return jsonify({"message": "Moderator deleted"}), 200
     return jsonify({"message": "Invalid User"}), 400
+
+
+@threads.cli.command("reconcile-stats")
+def reconcile_stats():
+    repaired = SubthreadStats.reconcile()
+    click.echo(f"[Threads] Repaired counters for {repaired} subthreads")
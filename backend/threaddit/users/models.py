@@ -1,4 +1,4 @@
-from sqlalchemy import func
+from sqlalchemy import func, text
 import cloudinary.uploader as uploader
 import uuid
 from threaddit import db, login_manager, app
@@ -267,3 +267,78 @@ class UsersKarma(db.Model):
             "posts_count": self.posts_count,
             "posts_karma": self.posts_karma,
         }
+
+
+class UserStats(db.Model):
+    # Ledger maintained by the user_stats_* triggers in schema.sql; user_info reads it.
+    __tablename__: str = "user_stats"
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    posts_count: int = db.Column(db.Integer, nullable=False, default=0)
+    posts_karma: int = db.Column(db.Integer, nullable=False, default=0)
+    comments_count: int = db.Column(db.Integer, nullable=False, default=0)
+    comments_karma: int = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def rebuild(cls) -> int:
+        # Recompute every user's ledger from posts/comments/reactions; returns how many rows changed.
+        # Votes still pending in karma_journal are left out, the next flush applies them.
+        result = db.session.execute(
+            text(
+                """
+                INSERT INTO user_stats (user_id, posts_count, posts_karma, comments_count, comments_karma)
+                SELECT
+                    u.id,
+                    (SELECT COUNT(*) FROM posts p WHERE p.user_id = u.id),
+                    COALESCE((
+                        SELECT SUM(CASE WHEN r.is_upvote THEN 1 ELSE -1 END)
+                        FROM posts p JOIN reactions r ON r.post_id = p.id
+                        WHERE p.user_id = u.id
+                    ), 0) - COALESCE((
+                        SELECT SUM(j.delta)
+                        FROM posts p JOIN karma_journal j ON j.post_id = p.id
+                        WHERE p.user_id = u.id
+                    ), 0),
+                    (SELECT COUNT(*) FROM comments c WHERE c.user_id = u.id),
+                    COALESCE((
+                        SELECT SUM(CASE WHEN r.is_upvote THEN 1 ELSE -1 END)
+                        FROM comments c JOIN reactions r ON r.comment_id = c.id
+                        WHERE c.user_id = u.id
+                    ), 0) - COALESCE((
+                        SELECT SUM(j.delta)
+                        FROM comments c JOIN karma_journal j ON j.comment_id = c.id
+                        WHERE c.user_id = u.id
+                    ), 0)
+                FROM users u
+                ON CONFLICT (user_id) DO UPDATE
+                SET posts_count = EXCLUDED.posts_count,
+                    posts_karma = EXCLUDED.posts_karma,
+                    comments_count = EXCLUDED.comments_count,
+                    comments_karma = EXCLUDED.comments_karma
+                WHERE (user_stats.posts_count, user_stats.posts_karma, user_stats.comments_count, user_stats.comments_karma)
+                    IS DISTINCT FROM (EXCLUDED.posts_count, EXCLUDED.posts_karma, EXCLUDED.comments_count, EXCLUDED.comments_karma)
+                """
+            )
+        )
+        db.session.commit()
+        return result.rowcount
+
+
+class UserRisk(db.Model):
+    # Suspicious-activity score per user, refreshed by `flask users rescore-risk`
+    # from the rows flagged by the user_risk_* triggers in schema.sql.
+    __tablename__: str = "user_risk"
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    score: int = db.Column(db.Integer, nullable=False, default=0)
+    level: str = db.Column(db.Text, nullable=False, default="none")
+    flags = db.Column(db.JSON, nullable=False, default=list)
+    needs_rescore: bool = db.Column(db.Boolean, nullable=False, default=True)
+    recheck_at = db.Column(db.DateTime(timezone=True))
+    scored_at = db.Column(db.DateTime(timezone=True))
+
+    def as_dict(self) -> dict:
+        return {
+            "is_suspicious": self.level != "none",
+            "score": self.score,
+            "level": self.level,
+            "flags": self.flags,
+        }
@@ -1,20 +1,28 @@
 from flask import Blueprint, request, jsonify
+import click
+import time
 from threaddit import db
 from threaddit.users.models import (
     UserLoginValidator,
     UserRegisterValidator,
     User,
+    UserRisk,
+    UserStats,
 )
 from threaddit.auth.decorators import auth_role
+from threaddit.users.utils import (
+    RISK_LEVEL_SCORES,
+    dedupe_user_relations,
+    get_activity_stats,
+    rescore_user_risk,
+    score_suspicious_activity,
+)
 from bcrypt import hashpw, checkpw, gensalt
 from flask_login import login_user, logout_user, current_user, login_required
 from threaddit.posts.models import Posts, PostInfo, SavedPosts
 from threaddit.comments.models import Comments, CommentInfo
 from threaddit.subthreads.models import Subscription
-from threaddit.reports.models import Report
-from threaddit.moderation.models import DeletionHistory
-from sqlalchemy import func, desc, and_
-from datetime import datetime, timedelta
+from sqlalchemy import desc
 
 user = Blueprint("users", __name__, url_prefix="/api")
 
@@ -403,6 +411,9 @@ def get_all_users_activity():
         limit = request.args.get("limit", default=50, type=int)
         offset = request.args.get("offset", default=0, type=int)
         search = request.args.get("search", default="", type=str)
+        min_level = request.args.get("min_level", default=None, type=str)
+        if min_level is not None and min_level not in RISK_LEVEL_SCORES:
+            return jsonify({"message": "Invalid min_level"}), 400
         
         # Base query for all users
         users_query = User.query
@@ -413,163 +424,29 @@ def get_all_users_activity():
                 User.username.ilike(f"%{search}%")
             )
         
-        # Get users with pagination
-        users = users_query.limit(limit).offset(offset).all()
+        # min_level reads the precomputed scores (idx_user_risk_score) instead of
+        # scoring every user; see `flask users rescore-risk`
+        risks = {}
+        if min_level:
+            users_query = users_query.join(UserRisk, UserRisk.user_id == User.id).filter(
+                UserRisk.score >= RISK_LEVEL_SCORES[min_level]
+            )
+            total_users = users_query.count()
+            users = users_query.order_by(UserRisk.score.desc(), UserRisk.user_id).limit(limit).offset(offset).all()
+            risks = {
+                risk.user_id: risk.as_dict()
+                for risk in UserRisk.query.filter(UserRisk.user_id.in_([user.id for user in users]))
+            }
+        else:
+            # Get users with pagination
+            users = users_query.limit(limit).offset(offset).all()
         
-        # Calculate suspicious activity for each user
+        # Counters for the whole page come from a few grouped queries
+        activity_stats = get_activity_stats([user.id for user in users])
         users_activity = []
-        from datetime import timezone
-        now = datetime.now(timezone.utc)
-        one_hour_ago = now - timedelta(hours=1)
-        one_day_ago = now - timedelta(days=1)
-        seven_days_ago = now - timedelta(days=7)
         
         for user in users:
-            user_id = user.id
-            
-            # Get basic stats
-            posts_count = Posts.query.filter_by(user_id=user_id).count()
-            comments_count = Comments.query.filter_by(user_id=user_id).count()
-            subscriptions_count = Subscription.query.filter_by(user_id=user_id).count()
-            
-            # Get recent activity counts (using func.now() for timezone-aware comparison)
-            posts_last_hour = Posts.query.filter(
-                and_(
-                    Posts.user_id == user_id,
-                    Posts.created_at >= func.now() - timedelta(hours=1)
-                )
-            ).count()
-            
-            comments_last_hour = Comments.query.filter(
-                and_(
-                    Comments.user_id == user_id,
-                    Comments.created_at >= func.now() - timedelta(hours=1)
-                )
-            ).count()
-            
-            posts_last_day = Posts.query.filter(
-                and_(
-                    Posts.user_id == user_id,
-                    Posts.created_at >= func.now() - timedelta(days=1)
-                )
-            ).count()
-            
-            comments_last_day = Comments.query.filter(
-                and_(
-                    Comments.user_id == user_id,
-                    Comments.created_at >= func.now() - timedelta(days=1)
-                )
-            ).count()
-            
-            # Get reports on user's posts
-            user_posts = Posts.query.filter_by(user_id=user_id).all()
-            post_ids = [p.id for p in user_posts]
-            reports_count = Report.query.filter(Report.post_id.in_(post_ids)).count() if post_ids else 0
-            pending_reports = Report.query.filter(
-                and_(Report.post_id.in_(post_ids), Report.status == "pending")
-            ).count() if post_ids else 0
-            
-            # Get deleted posts count
-            deleted_posts_count = DeletionHistory.query.filter_by(original_author_id=user_id).count()
-            
-            # Get karma info
-            karma_info = user.user_karma[0] if user.user_karma else None
-            total_karma = karma_info.user_karma if karma_info else 0
-            posts_karma = karma_info.posts_karma if karma_info else 0
-            comments_karma = karma_info.comments_karma if karma_info else 0
-            
-            # Calculate suspicious activity score
-            suspicious_flags = []
-            suspicious_score = 0
-            
-            # Flag 1: Rapid posting (more than 10 posts in 1 hour)
-            if posts_last_hour > 10:
-                suspicious_flags.append({
-                    "type": "rapid_posting",
-                    "severity": "high",
-                    "message": f"User posted {posts_last_hour} posts in the last hour",
-                    "value": posts_last_hour
-                })
-                suspicious_score += 30
-            
-            # Flag 2: Rapid commenting (more than 20 comments in 1 hour)
-            if comments_last_hour > 20:
-                suspicious_flags.append({
-                    "type": "rapid_commenting",
-                    "severity": "medium",
-                    "message": f"User made {comments_last_hour} comments in the last hour",
-                    "value": comments_last_hour
-                })
-                suspicious_score += 20
-            
-            # Flag 3: High number of reports
-            if reports_count > 5:
-                suspicious_flags.append({
-                    "type": "high_reports",
-                    "severity": "high",
-                    "message": f"User's posts have {reports_count} reports ({pending_reports} pending)",
-                    "value": reports_count,
-                    "pending": pending_reports
-                })
-                suspicious_score += 25
-            
-            # Flag 4: Many deleted posts
-            if deleted_posts_count > 3:
-                suspicious_flags.append({
-                    "type": "deleted_posts",
-                    "severity": "medium",
-                    "message": f"User has {deleted_posts_count} deleted posts",
-                    "value": deleted_posts_count
-                })
-                suspicious_score += 15
-            
-            # Flag 5: Negative karma trend
-            if total_karma < -10:
-                suspicious_flags.append({
-                    "type": "negative_karma",
-                    "severity": "low",
-                    "message": f"User has negative karma: {total_karma}",
-                    "value": total_karma
-                })
-                suspicious_score += 10
-            
-            # Flag 6: Very high activity in last day
-            if posts_last_day > 50 or comments_last_day > 100:
-                suspicious_flags.append({
-                    "type": "excessive_activity",
-                    "severity": "medium",
-                    "message": f"User posted {posts_last_day} posts and {comments_last_day} comments in last 24 hours",
-                    "value": {"posts": posts_last_day, "comments": comments_last_day}
-                })
-                suspicious_score += 20
-            
-            # Determine overall suspicious status
-            is_suspicious = suspicious_score >= 30
-            suspicious_level = "none"
-            if suspicious_score >= 60:
-                suspicious_level = "high"
-            elif suspicious_score >= 40:
-                suspicious_level = "medium"
-            elif suspicious_score >= 30:
-                suspicious_level = "low"
-            
-            # Get recent posts (last 3)
-            recent_posts = PostInfo.query.filter(PostInfo.user_id == user_id)\
-                .order_by(desc(PostInfo.created_at))\
-                .limit(3)\
-                .all()
-            
-            recent_posts_data = [
-                {
-                    "id": post.post_id,
-                    "title": post.title,
-                    "community": post.thread_name,
-                    "karma": post.post_karma or 0,
-                    "created_at": post.created_at.isoformat() if post.created_at else None,
-                }
-                for post in recent_posts
-            ]
-            
+            stats = activity_stats[user.id]
             users_activity.append({
                 "user": {
                     "id": user.id,
@@ -579,40 +456,36 @@ def get_all_users_activity():
                     "registration_date": user.registration_date.isoformat() if user.registration_date else None,
                 },
                 "stats": {
-                    "posts_count": posts_count,
-                    "comments_count": comments_count,
-                    "communities_joined": subscriptions_count,
-                    "total_karma": total_karma,
-                    "posts_karma": posts_karma,
-                    "comments_karma": comments_karma,
+                    "posts_count": stats["posts_count"],
+                    "comments_count": stats["comments_count"],
+                    "communities_joined": stats["subscriptions_count"],
+                    "total_karma": stats["total_karma"],
+                    "posts_karma": stats["posts_karma"],
+                    "comments_karma": stats["comments_karma"],
                 },
                 "recent_activity": {
-                    "posts_last_hour": posts_last_hour,
-                    "comments_last_hour": comments_last_hour,
-                    "posts_last_day": posts_last_day,
-                    "comments_last_day": comments_last_day,
+                    "posts_last_hour": stats["posts_last_hour"],
+                    "comments_last_hour": stats["comments_last_hour"],
+                    "posts_last_day": stats["posts_last_day"],
+                    "comments_last_day": stats["comments_last_day"],
                 },
                 "moderation": {
-                    "reports_count": reports_count,
-                    "pending_reports": pending_reports,
-                    "deleted_posts_count": deleted_posts_count,
-                },
-                "suspicious_activity": {
-                    "is_suspicious": is_suspicious,
-                    "score": suspicious_score,
-                    "level": suspicious_level,
-                    "flags": suspicious_flags,
+                    "reports_count": stats["reports_count"],
+                    "pending_reports": stats["pending_reports"],
+                    "deleted_posts_count": stats["deleted_posts_count"],
                 },
-                "recent_posts": recent_posts_data,
+                "suspicious_activity": risks.get(user.id) or score_suspicious_activity(stats),
+                "recent_posts": stats["recent_posts"],
             })
         
         # Sort by suspicious score (highest first)
         users_activity.sort(key=lambda x: x["suspicious_activity"]["score"], reverse=True)
         
         # Get total count for pagination
-        total_users = User.query.count()
-        if search:
-            total_users = User.query.filter(User.username.ilike(f"%{search}%")).count()
+        if not min_level:
+            total_users = User.query.count()
+            if search:
+                total_users = User.query.filter(User.username.ilike(f"%{search}%")).count()
         
         return jsonify({
             "users": users_activity,
@@ -635,3 +508,27 @@ def get_all_users_activity():
         print(traceback.format_exc())
         db.session.rollback()
         return jsonify({"message": f"Error fetching users activity: {str(e)}"}), 500
+
+
+@user.cli.command("rebuild-karma")
+def rebuild_karma():
+    rebuilt = UserStats.rebuild()
+    click.echo(f"[Users] Rebuilt karma for {rebuilt} users")
+
+
+@user.cli.command("dedupe-relations")
+def dedupe_relations():
+    removed = dedupe_user_relations()
+    click.echo("[Users] Removed duplicates: " + ", ".join(f"{kind}={count}" for kind, count in removed.items()))
+
+
+@user.cli.command("rescore-risk")
+@click.option("--interval", default=0, type=int, help="Seconds between passes; 0 runs a single pass.")
+@click.option("--batch-size", default=500, type=int)
+def rescore_risk(interval, batch_size):
+    while True:
+        rescored = rescore_user_risk(batch_size=batch_size)
+        click.echo(f"[Users] Rescored risk for {rescored} users")
+        if interval <= 0:
+            return
+        time.sleep(interval)
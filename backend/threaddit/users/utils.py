@@ -0,0 +1,313 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, text, update
+from threaddit import db
+from threaddit.posts.models import Posts, PostInfo
+from threaddit.comments.models import Comments
+from threaddit.subthreads.models import Subscription
+from threaddit.reports.models import Report
+from threaddit.moderation.models import DeletionHistory
+from threaddit.users.models import UserRisk, UsersKarma
+
+
+# Minimum suspicious-activity score for each level.
+RISK_LEVEL_SCORES = {"low": 30, "medium": 40, "high": 60}
+
+
+def get_activity_stats(user_ids, include_recent_posts=True):
+    """Collect the moderator-dashboard counters for a page of users.
+
+    Every counter is one grouped query over the whole page (time windows use
+    ``COUNT(*) FILTER (WHERE ...)``), so the number of queries does not depend on
+    the page size. Returns ``{user_id: stats}``; users without activity get zeros.
+    ``window_expires_at`` is the earliest time one of the sliding-window counts
+    will drop, or None when the windows are empty.
+    """
+    stats = {
+        user_id: {
+            "posts_count": 0,
+            "comments_count": 0,
+            "subscriptions_count": 0,
+            "posts_last_hour": 0,
+            "comments_last_hour": 0,
+            "posts_last_day": 0,
+            "comments_last_day": 0,
+            "reports_count": 0,
+            "pending_reports": 0,
+            "deleted_posts_count": 0,
+            "total_karma": 0,
+            "posts_karma": 0,
+            "comments_karma": 0,
+            "recent_posts": [],
+            "window_expires_at": None,
+        }
+        for user_id in user_ids
+    }
+    if not user_ids:
+        return stats
+    last_hour = func.now() - timedelta(hours=1)
+    last_day = func.now() - timedelta(days=1)
+
+    for model, prefix in ((Posts, "posts"), (Comments, "comments")):
+        rows = (
+            db.session.query(
+                model.user_id,
+                func.count(),
+                func.count().filter(model.created_at >= last_hour),
+                func.count().filter(model.created_at >= last_day),
+                func.min(model.created_at).filter(model.created_at >= last_hour),
+                func.min(model.created_at).filter(model.created_at >= last_day),
+            )
+            .filter(model.user_id.in_(user_ids))
+            .group_by(model.user_id)
+        )
+        for user_id, total, hour, day, oldest_in_hour, oldest_in_day in rows:
+            stats[user_id].update(
+                {f"{prefix}_count": total, f"{prefix}_last_hour": hour, f"{prefix}_last_day": day}
+            )
+            expiries = [stats[user_id]["window_expires_at"]]
+            if oldest_in_hour:
+                expiries.append(oldest_in_hour + timedelta(hours=1))
+            if oldest_in_day:
+                expiries.append(oldest_in_day + timedelta(days=1))
+            expiries = [e for e in expiries if e]
+            stats[user_id]["window_expires_at"] = min(expiries) if expiries else None
+
+    subscriptions = (
+        db.session.query(Subscription.user_id, func.count())
+        .filter(Subscription.user_id.in_(user_ids))
+        .group_by(Subscription.user_id)
+    )
+    for user_id, total in subscriptions:
+        stats[user_id]["subscriptions_count"] = total
+
+    reports = (
+        db.session.query(Posts.user_id, func.count(), func.count().filter(Report.status == "pending"))
+        .join(Report, Report.post_id == Posts.id)
+        .filter(Posts.user_id.in_(user_ids))
+        .group_by(Posts.user_id)
+    )
+    for user_id, total, pending in reports:
+        stats[user_id].update({"reports_count": total, "pending_reports": pending})
+
+    deletions = (
+        db.session.query(DeletionHistory.original_author_id, func.count())
+        .filter(DeletionHistory.original_author_id.in_(user_ids))
+        .group_by(DeletionHistory.original_author_id)
+    )
+    for user_id, total in deletions:
+        stats[user_id]["deleted_posts_count"] = total
+
+    for karma in UsersKarma.query.filter(UsersKarma.user_id.in_(user_ids)):
+        stats[karma.user_id].update(
+            {
+                "total_karma": karma.user_karma,
+                "posts_karma": karma.posts_karma,
+                "comments_karma": karma.comments_karma,
+            }
+        )
+
+    if not include_recent_posts:
+        return stats
+
+    # Three most recent posts per user in one pass with a window function.
+    ranked = (
+        db.session.query(
+            PostInfo,
+            func.row_number()
+            .over(partition_by=PostInfo.user_id, order_by=PostInfo.created_at.desc())
+            .label("rank"),
+        )
+        .filter(PostInfo.user_id.in_(user_ids))
+        .subquery()
+    )
+    recent_posts = (
+        db.session.query(db.aliased(PostInfo, ranked))
+        .filter(ranked.c.rank <= 3)
+        .order_by(ranked.c.user_id, ranked.c.rank)
+    )
+    for post in recent_posts:
+        stats[post.user_id]["recent_posts"].append(
+            {
+                "id": post.post_id,
+                "title": post.title,
+                "community": post.thread_name,
+                "karma": post.post_karma or 0,
+                "created_at": post.created_at.isoformat() if post.created_at else None,
+            }
+        )
+    return stats
+
+
+def score_suspicious_activity(stats):
+    """Apply the suspicious-activity thresholds to one user's counters."""
+    flags = []
+    score = 0
+
+    # Flag 1: Rapid posting (more than 10 posts in 1 hour)
+    if stats["posts_last_hour"] > 10:
+        flags.append({
+            "type": "rapid_posting",
+            "severity": "high",
+            "message": f"User posted {stats['posts_last_hour']} posts in the last hour",
+            "value": stats["posts_last_hour"]
+        })
+        score += 30
+
+    # Flag 2: Rapid commenting (more than 20 comments in 1 hour)
+    if stats["comments_last_hour"] > 20:
+        flags.append({
+            "type": "rapid_commenting",
+            "severity": "medium",
+            "message": f"User made {stats['comments_last_hour']} comments in the last hour",
+            "value": stats["comments_last_hour"]
+        })
+        score += 20
+
+    # Flag 3: High number of reports
+    if stats["reports_count"] > 5:
+        flags.append({
+            "type": "high_reports",
+            "severity": "high",
+            "message": f"User's posts have {stats['reports_count']} reports ({stats['pending_reports']} pending)",
+            "value": stats["reports_count"],
+            "pending": stats["pending_reports"]
+        })
+        score += 25
+
+    # Flag 4: Many deleted posts
+    if stats["deleted_posts_count"] > 3:
+        flags.append({
+            "type": "deleted_posts",
+            "severity": "medium",
+            "message": f"User has {stats['deleted_posts_count']} deleted posts",
+            "value": stats["deleted_posts_count"]
+        })
+        score += 15
+
+    # Flag 5: Negative karma trend
+    if stats["total_karma"] < -10:
+        flags.append({
+            "type": "negative_karma",
+            "severity": "low",
+            "message": f"User has negative karma: {stats['total_karma']}",
+            "value": stats["total_karma"]
+        })
+        score += 10
+
+    # Flag 6: Very high activity in last day
+    if stats["posts_last_day"] > 50 or stats["comments_last_day"] > 100:
+        flags.append({
+            "type": "excessive_activity",
+            "severity": "medium",
+            "message": f"User posted {stats['posts_last_day']} posts and {stats['comments_last_day']} comments in last 24 hours",
+            "value": {"posts": stats["posts_last_day"], "comments": stats["comments_last_day"]}
+        })
+        score += 20
+
+    # Determine overall suspicious status
+    level = "none"
+    if score >= RISK_LEVEL_SCORES["high"]:
+        level = "high"
+    elif score >= RISK_LEVEL_SCORES["medium"]:
+        level = "medium"
+    elif score >= RISK_LEVEL_SCORES["low"]:
+        level = "low"
+    return {
+        "is_suspicious": score >= RISK_LEVEL_SCORES["low"],
+        "score": score,
+        "level": level,
+        "flags": flags,
+    }
+
+
+def rescore_user_risk(batch_size=500):
+    """Refresh user_risk for users flagged by the user_risk_* triggers, and for
+    users whose sliding-window counts have expired since they were last scored.
+
+    Claimed rows stay locked until the batch commits, so an event arriving
+    meanwhile re-flags the user for the next pass. Returns how many users were scored.
+    """
+    total = 0
+    while True:
+        user_ids = [
+            row.user_id
+            for row in db.session.execute(
+                text(
+                    """
+                    SELECT user_id FROM user_risk
+                    WHERE needs_rescore OR recheck_at <= now()
+                    ORDER BY user_id
+                    LIMIT :batch_size
+                    FOR UPDATE SKIP LOCKED
+                    """
+                ),
+                {"batch_size": batch_size},
+            )
+        ]
+        if not user_ids:
+            db.session.commit()
+            return total
+        activity_stats = get_activity_stats(user_ids, include_recent_posts=False)
+        scored_at = datetime.now(timezone.utc)
+        rows = []
+        for user_id in user_ids:
+            risk = score_suspicious_activity(activity_stats[user_id])
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "score": risk["score"],
+                    "level": risk["level"],
+                    "flags": risk["flags"],
+                    "needs_rescore": False,
+                    "recheck_at": activity_stats[user_id]["window_expires_at"],
+                    "scored_at": scored_at,
+                }
+            )
+        db.session.execute(update(UserRisk), rows)
+        db.session.commit()
+        total += len(user_ids)
+        if len(user_ids) < batch_size:
+            return total
+
+
+# Duplicate (user, target) rows left from before the unique constraints; the
+# newest reaction and the oldest save/subscription are kept. schema.sql runs the
+# same statements.
+_DEDUPE_STATEMENTS = {
+    "post_reactions": """
+        DELETE FROM reactions r USING reactions newer
+        WHERE newer.user_id = r.user_id AND newer.post_id = r.post_id AND newer.id > r.id
+    """,
+    "comment_reactions": """
+        DELETE FROM reactions r USING reactions newer
+        WHERE newer.user_id = r.user_id AND newer.comment_id = r.comment_id AND newer.id > r.id
+    """,
+    "saved": """
+        DELETE FROM saved s USING saved older
+        WHERE older.user_id = s.user_id AND older.post_id = s.post_id AND older.id < s.id
+    """,
+    "subscriptions": """
+        DELETE FROM subscriptions s USING subscriptions older
+        WHERE older.user_id = s.user_id AND older.subthread_id = s.subthread_id AND older.id < s.id
+    """,
+}
+_UNIQUE_INDEXES = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS reactions_user_id_post_id_key ON reactions(user_id, post_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS reactions_user_id_comment_id_key ON reactions(user_id, comment_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS saved_user_id_post_id_key ON saved(user_id, post_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS subscriptions_user_id_subthread_id_key ON subscriptions(user_id, subthread_id)",
+)
+
+
+def dedupe_user_relations():
+    """Delete duplicate reactions, saves and subscriptions, then add the unique
+    indexes that keep them out. One transaction; the tables are locked for its
+    duration so no duplicate can slip in between the two steps. Returns the
+    number of deleted rows per kind.
+    """
+    db.session.execute(text("LOCK TABLE reactions, saved, subscriptions IN SHARE ROW EXCLUSIVE MODE"))
+    removed = {kind: db.session.execute(text(statement)).rowcount for kind, statement in _DEDUPE_STATEMENTS.items()}
+    for statement in _UNIQUE_INDEXES:
+        db.session.execute(text(statement))
+    db.session.commit()
+    return removed
@@ -5,6 +5,7 @@ import { useQuery, useQueryClient } from "@tanstack/react-query";
 import api from "../api.js";
 import LiveSuggestions from "../pages/Find/LiveSuggestions.jsx";
 import { useAuth } from "../hooks/useAuth.js";
+import { useMessageStream } from "../hooks/useMessageStream.js";
 
 export default function Navbar() {
   const navigate = useNavigate();
@@ -45,6 +46,9 @@ export default function Navbar() {
     };
   }, [showUserMenu, showMobileMenu, isFindHovered, isFindFocused]);
 
+  // Unread count is pushed over the message stream; polling is only the fallback
+  const streamConnected = useMessageStream(isAuthenticated);
+
   // Fetch unread messages count (only when authenticated)
   const { data: unreadData } = useQuery({
     queryKey: ["unreadCount"],
@@ -58,7 +62,7 @@ export default function Navbar() {
     },
     enabled: isAuthenticated,
     retry: 1,
-    refetchInterval: 15000, // Poll every 15 seconds
+    refetchInterval: streamConnected ? false : 15000, // Poll every 15 seconds while the stream is down
   });
 
   const handleLogout = async () => {
@@ -0,0 +1,127 @@
+import { useEffect, useState } from "react";
+import { useQueryClient } from "@tanstack/react-query";
+import api from "../api.js";
+
+const STREAM_EVENTS = ["message", "seen", "unread_count"];
+const RETRY_MIN_MS = 5000;
+const RETRY_MAX_MS = 120000;
+
+// One EventSource is shared by every component that uses the hook
+let source = null;
+let subscribers = 0;
+let hasConnected = false;
+let retryTimer = null;
+let retryDelay = RETRY_MIN_MS;
+const connectionListeners = new Set();
+const reconnectListeners = new Set();
+const eventHandlers = new Map(STREAM_EVENTS.map((name) => [name, new Set()]));
+
+function setConnected(connected) {
+  connectionListeners.forEach((listener) => listener(connected));
+}
+
+function scheduleRetry() {
+  if (retryTimer || subscribers === 0) {
+    return;
+  }
+  retryTimer = setTimeout(() => {
+    retryTimer = null;
+    if (subscribers > 0 && !source) {
+      openSource();
+    }
+  }, retryDelay);
+  retryDelay = Math.min(retryDelay * 2, RETRY_MAX_MS);
+}
+
+function openSource() {
+  const eventSource = new EventSource(`${api.defaults.baseURL}/api/messages/stream`, { withCredentials: true });
+  source = eventSource;
+  eventSource.onopen = () => {
+    retryDelay = RETRY_MIN_MS;
+    setConnected(true);
+    // Events sent while we were disconnected are lost; refetch what they would have updated
+    if (hasConnected) {
+      reconnectListeners.forEach((listener) => listener());
+    }
+    hasConnected = true;
+  };
+  eventSource.onerror = () => {
+    setConnected(false);
+    // The browser retries on its own unless the stream was refused (e.g. 503 when the
+    // server is at its stream limit); then start over later with a fresh EventSource
+    if (eventSource.readyState === EventSource.CLOSED && source === eventSource) {
+      source = null;
+      scheduleRetry();
+    }
+  };
+  STREAM_EVENTS.forEach((name) => {
+    eventSource.addEventListener(name, (event) => eventHandlers.get(name).forEach((handler) => handler(event)));
+  });
+}
+
+/**
+ * Subscribes to /api/messages/stream (server-sent events) and keeps the
+ * inbox, conversation (including read receipts) and unread-count queries up to date.
+ * Returns whether the stream is connected so callers can fall back to polling.
+ */
+export function useMessageStream(enabled = true) {
+  const queryClient = useQueryClient();
+  const [connected, setIsConnected] = useState(source?.readyState === 1);
+
+  useEffect(() => {
+    if (!enabled || typeof EventSource === "undefined") {
+      return undefined;
+    }
+
+    const handleMessage = (event) => {
+      // Oversized events arrive without data; refresh every open conversation then
+      const message = JSON.parse(event.data) || {};
+      const contact = message.is_sent ? message.receiver?.username : message.sender?.username;
+      queryClient.invalidateQueries({ queryKey: contact ? ["messages", contact] : ["messages"] });
+      queryClient.invalidateQueries({ queryKey: ["inbox"] });
+    };
+    const handleSeen = (event) => {
+      // The other participant read our messages; refresh that conversation's receipts
+      const { reader } = JSON.parse(event.data) || {};
+      queryClient.invalidateQueries({ queryKey: reader ? ["messages", reader] : ["messages"] });
+      queryClient.invalidateQueries({ queryKey: ["inbox"] });
+    };
+    const handleUnreadCount = (event) => {
+      queryClient.setQueryData(["unreadCount"], JSON.parse(event.data));
+    };
+    const handleReconnect = () => {
+      queryClient.invalidateQueries({ queryKey: ["messages"] });
+      queryClient.invalidateQueries({ queryKey: ["inbox"] });
+      queryClient.invalidateQueries({ queryKey: ["unreadCount"] });
+    };
+
+    connectionListeners.add(setIsConnected);
+    reconnectListeners.add(handleReconnect);
+    eventHandlers.get("message").add(handleMessage);
+    eventHandlers.get("seen").add(handleSeen);
+    eventHandlers.get("unread_count").add(handleUnreadCount);
+    subscribers += 1;
+    if (!source && !retryTimer) {
+      openSource();
+    }
+
+    return () => {
+      eventHandlers.get("message").delete(handleMessage);
+      eventHandlers.get("seen").delete(handleSeen);
+      eventHandlers.get("unread_count").delete(handleUnreadCount);
+      reconnectListeners.delete(handleReconnect);
+      connectionListeners.delete(setIsConnected);
+      subscribers -= 1;
+      if (subscribers === 0) {
+        clearTimeout(retryTimer);
+        retryTimer = null;
+        retryDelay = RETRY_MIN_MS;
+        hasConnected = false;
+        source?.close();
+        source = null;
+      }
+    };
+  }, [enabled, queryClient]);
+
+  return connected;
+}
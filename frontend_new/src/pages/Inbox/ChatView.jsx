@@ -3,6 +3,7 @@ import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
 import { motion, AnimatePresence } from "framer-motion";
 import { Link } from "react-router-dom";
 import api from "../../api.js";
+import { useMessageStream } from "../../hooks/useMessageStream.js";
 import UserMessageBubble from "../../components/UserMessageBubble.jsx";
 
 export default function ChatView({ contactUsername, onBack, onMessageSent }) {
@@ -28,6 +29,9 @@ export default function ChatView({ contactUsername, onBack, onMessageSent }) {
     retry: 1,
   });
 
+  // New messages in this conversation are pushed over the message stream
+  const streamConnected = useMessageStream(!!contactUsername);
+
   // Fetch conversation messages
   const {
     data: messagesData,
@@ -40,7 +44,7 @@ export default function ChatView({ contactUsername, onBack, onMessageSent }) {
       return response.data;
     },
     enabled: !!contactUsername,
-    refetchInterval: 3000, // Poll every 3 seconds for new messages
+    refetchInterval: streamConnected ? false : 3000, // Poll every 3 seconds while the stream is down
   });
 
   // Scroll to bottom when new messages arrive
@@ -3,6 +3,7 @@ import { useNavigate } from "react-router-dom";
 import { motion, AnimatePresence } from "framer-motion";
 import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
 import api from "../../api.js";
+import { useMessageStream } from "../../hooks/useMessageStream.js";
 import Navbar from "../../components/Navbar.jsx";
 import ChatView from "./ChatView.jsx";
 
@@ -37,6 +38,9 @@ export default function InboxPage() {
     cacheTime: 0,
   });
 
+  // New messages and unread counts are pushed over the message stream
+  const streamConnected = useMessageStream(!!user);
+
   // Fetch inbox conversations
   const { data: inboxData, isLoading: inboxLoading, refetch: refetchInbox } = useQuery({
     queryKey: ["inbox"],
@@ -46,7 +50,7 @@ export default function InboxPage() {
     },
     enabled: !!user,
     retry: 1,
-    refetchInterval: 5000, // Poll every 5 seconds for new messages
+    refetchInterval: streamConnected ? false : 5000, // Poll every 5 seconds while the stream is down
   });
 
   // Fetch all users for new conversations
@@ -69,7 +73,7 @@ export default function InboxPage() {
     },
     enabled: !!user,
     retry: 1,
-    refetchInterval: 10000, // Poll every 10 seconds
+    refetchInterval: streamConnected ? false : 10000, // Poll every 10 seconds while the stream is down
   });
 
   // Redirect if not authenticated